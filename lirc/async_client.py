@@ -37,43 +37,135 @@
 #              loop.run_until_complete(main(socket_path, loop))
 #              loop.close()
 
+#
+#   Reading raw data using asyncio protocols
+#   ----------------------------------------
+#
+#   The AsyncRawConnection reads directly from the lircd socket using an
+#   asyncio transport, without any RawConnection. All complete lines in
+#   each received chunk are queued without creating any tasks. The queue
+#   is bounded; the overflow argument decides what happens when it's
+#   full, see Overflow. Usage:
+#
+#          async def main(socket_path):
+#              async with lirc.async_client.AsyncRawConnection(
+#                      socket_path, maxsize=64,
+#                      overflow=lirc.async_client.Overflow.COALESCE) as c:
+#                  async for keypress in c:
+#                      print(keypress)
+
+#
+#   Sending commands
+#   ----------------
+#
+#   The AsyncCommandConnection writes commands as soon as they are issued
+#   without waiting for the replies of earlier ones. Replies are matched
+#   to the commands in FIFO order:
+#
+#          async def main(socket_path):
+#              async with lirc.async_client.AsyncCommandConnection(
+#                      socket_path) as conn:
+#                  replies = await asyncio.gather(*[
+#                      conn.run(lirc.client.SendCommand(conn, remote, [key]))
+#                      for key in keys])
+#
+#   The Command constructors just store the connection, so commands can
+#   be created using the async connection as above.
+
 #   pylint: disable=W0613
 
 import asyncio
+import collections
+from enum import Enum
+import time
+
+import lirc.client
+import lirc.metrics
+import lirc.protocol
+import lirc.tcp
+
+
+async def _connect(protocol_factory, address):
+    ''' Connect to a unix socket path or a tcp:// address. '''
+    loop = asyncio.get_running_loop()
+    if not lirc.tcp.is_tcp_address(address):
+        await loop.create_unix_connection(protocol_factory, address)
+        return
+    host, port = lirc.tcp.parse_address(address)
+    transport, _ = await asyncio.wait_for(
+        loop.create_connection(protocol_factory, host, port),
+        lirc.tcp.CONNECT_TIMEOUT)
+    lirc.tcp.configure(transport.get_extra_info("socket"))
+
+
+_EOF = object()
 
 
 class AsyncConnection(object):
-    ''' Asynchronous read interface on top of a Connection. '''
+    '''
+    Asynchronous read interface on top of a Connection. The metrics
+    attribute is the one of the connection, see lirc.metrics.
+    '''
 
     def __init__(self, connection, loop):
 
         def read_from_fd():
             ''' Read data from the conn fd and put into queue. '''
-            line = self._conn.readline(0)
-            if line:
-                asyncio.ensure_future(self._queue.put(line))
+            try:
+                lines = self._conn.readlines(timeout=0)
+            except ConnectionError as ex:
+                self._loop.remove_reader(self._conn.fileno())
+                self._exception = ex
+                self._queue.put_nowait(_EOF)
+                return
+            for line in lines:
+                self._queue.put_nowait(line)
+            if self.metrics:
+                self.metrics.gauge("queue_depth", self._queue.qsize())
 
         self._conn = connection
         self._loop = loop
-        self._queue = asyncio.Queue(loop=self._loop)
+        self._queue = asyncio.Queue()
+        self._exception = None
         self._loop.add_reader(self._conn.fileno(), read_from_fd)
 
+    @property
+    def metrics(self):
+        ''' The lirc.metrics.Metrics of the connection, or None. '''
+        return getattr(self._conn, "metrics", None)
+
+    @metrics.setter
+    def metrics(self, metrics):
+        ''' Set lirc.metrics.Metrics of the connection. '''
+        self._conn.metrics = metrics
+
     def close(self):
         ''' Clean up loop and the base connection. '''
         self._loop.remove_reader(self._conn.fileno())
         self._conn.close()
 
     async def readline(self):
-        ''' Asynchronous get next line from the connection. '''
-        return await self._queue.get()
+        '''
+        Asynchronous get next line from the connection. Raises
+        ConnectionResetError or the actual error if the connection is
+        lost and queue is empty.
+        '''
+        line = await self._queue.get()
+        if line is _EOF:
+            self._queue.put_nowait(_EOF)
+            raise self._exception
+        return line
 
     def __aiter__(self):
         ''' Return async iterator. '''
         return self
 
     async def __anext__(self):
-        ''' Implement async iterator.next(). '''
-        return await self._queue.get()
+        ''' Implement async iterator.next(), stops on closed connection. '''
+        try:
+            return await self.readline()
+        except ConnectionError:
+            raise StopAsyncIteration
 
     async def __aenter__(self):
         ''' Implement enter async context manager. '''
@@ -82,3 +174,296 @@ class AsyncConnection(object):
     async def __aexit__(self, exc_type, exc, traceback):
         ''' Implement exit async context manager. '''
         self.close()
+
+
+class Overflow(Enum):
+    '''
+    AsyncRawConnection policy when the queue is full:
+      - BLOCK: Stop reading from the socket until the consumer has
+        emptied half of the queue.
+      - DROP_OLDEST: Discard the oldest queued line.
+      - COALESCE: Replace the newest queued line if the new one is a
+        repeat of the same button, otherwise discard the oldest one.
+    '''
+    BLOCK = 1
+    DROP_OLDEST = 2
+    COALESCE = 3
+
+
+def _is_repeat_of(line, previous):
+    ''' Check if line is a repeat of the button in previous line. '''
+    words = line.split()
+    prev_words = previous.split()
+    return len(words) == 4 and len(prev_words) == 4 \
+        and words[1] != "00" and words[0] == prev_words[0] \
+        and words[2:] == prev_words[2:]
+
+
+class _LineProtocol(asyncio.Protocol):
+    ''' Splits received data into lines handed to the connection. '''
+
+    def __init__(self, connection):
+        self._conn = connection
+        self._buffer = bytearray(0)
+
+    def connection_made(self, transport):
+        self._conn.transport = transport
+
+    def data_received(self, data):
+        self._buffer += data
+        end = self._buffer.rfind(b'\n')
+        if end < 0:
+            return
+        lines = self._buffer[:end].decode("ascii", "ignore").split("\n")
+        del self._buffer[:end + 1]
+        self._conn.push(lines)
+
+    def connection_lost(self, exc):
+        self._conn.connection_lost(exc)
+
+
+class AsyncRawConnection(object):
+    '''
+    Asynchronous read interface on top of an asyncio unix socket or TCP
+    transport. Parameters:
+      - socket_path: lircd output socket path or tcp:// address, see
+        lirc.client.get_default_socket_path() for defaults.
+      - maxsize: Max number of queued lines.
+      - overflow: Overflow policy when queue is full.
+
+    The attribute dropped counts lines discarded or coalesced due to
+    overflow. The metrics attribute is None or a lirc.metrics.Metrics
+    recording lines, queue depth and dropped lines.
+    '''
+
+    def __init__(self, socket_path=None, maxsize=1024,
+                 overflow=Overflow.BLOCK):
+        self.socket_path = \
+            socket_path or lirc.client.get_default_socket_path()
+        self.transport = None
+        self.metrics = None
+        self.dropped = 0
+        self._maxsize = maxsize
+        self._overflow = overflow
+        self._queue = collections.deque()
+        self._waiter = None
+        self._paused = False
+        self._exception = None
+
+    async def connect(self):
+        ''' Connect to the lircd socket. '''
+        await _connect(lambda: _LineProtocol(self), self.socket_path)
+
+    def push(self, lines):
+        ''' Add lines to queue according to overflow policy. '''
+        queue = self._queue
+        dropped = self.dropped
+        for line in lines:
+            if len(queue) < self._maxsize \
+                    or self._overflow == Overflow.BLOCK:
+                queue.append(line)
+            elif self._overflow == Overflow.COALESCE \
+                    and _is_repeat_of(line, queue[-1]):
+                queue[-1] = line
+                self.dropped += 1
+            else:
+                queue.popleft()
+                queue.append(line)
+                self.dropped += 1
+        if len(queue) >= self._maxsize and self._overflow == Overflow.BLOCK \
+                and not self._paused:
+            self.transport.pause_reading()
+            self._paused = True
+        if self.metrics:
+            self.metrics.count("lines", len(lines))
+            self.metrics.gauge("queue_depth", len(queue))
+            if self.dropped > dropped:
+                self.metrics.count("dropped", self.dropped - dropped)
+        self._wakeup()
+
+    def connection_lost(self, exc):
+        ''' Handle closed or broken connection. '''
+        self._exception = exc or ConnectionResetError(
+            "lircd closed the connection.")
+        self._wakeup()
+
+    def _wakeup(self):
+        ''' Wake up a pending readline(). '''
+        if self._waiter and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def qsize(self):
+        ''' Return number of queued lines. '''
+        return len(self._queue)
+
+    def close(self):
+        ''' Close the transport. '''
+        if self.transport:
+            self.transport.close()
+
+    async def readline(self):
+        '''
+        Asynchronous get next line from the connection. Raises
+        ConnectionResetError or the actual error if the connection is
+        lost and queue is empty.
+        '''
+        while not self._queue:
+            if self._exception:
+                raise self._exception
+            self._waiter = asyncio.get_running_loop().create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+        line = self._queue.popleft()
+        if self._paused and len(self._queue) <= self._maxsize // 2:
+            self._paused = False
+            self.transport.resume_reading()
+        return line
+
+    def __aiter__(self):
+        ''' Return async iterator. '''
+        return self
+
+    async def __anext__(self):
+        ''' Implement async iterator.next(), stops on closed connection. '''
+        try:
+            return await self.readline()
+        except ConnectionError:
+            raise StopAsyncIteration
+
+    async def __aenter__(self):
+        ''' Implement enter async context manager, connecting. '''
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        ''' Implement exit async context manager. '''
+        self.close()
+
+
+class _CommandProtocol(asyncio.Protocol):
+    ''' Hands received data to the connection. '''
+
+    def __init__(self, connection):
+        self._conn = connection
+
+    def connection_made(self, transport):
+        self._conn.transport = transport
+
+    def data_received(self, data):
+        self._conn.data_received(data)
+
+    def connection_lost(self, exc):
+        self._conn.connection_lost(exc)
+
+
+class AsyncCommandConnection(object):
+    '''
+    Asynchronous, pipelined command interface. Commands are written
+    immediately; replies are parsed by a lirc.protocol.LircdProtocol and
+    delivered to the oldest waiting command. Parameters:
+      - socket_path: lircd socket path or tcp:// address, see
+        lirc.client.get_default_socket_path() for defaults.
+
+    The sighups attribute counts received SIGHUP packets. A reply
+    received after a SIGHUP packet has its sighup attribute set. The
+    metrics attribute is None or a lirc.metrics.Metrics recording the
+    round trip time of run().
+    '''
+
+    def __init__(self, socket_path=None):
+        self.socket_path = \
+            socket_path or lirc.client.get_default_socket_path()
+        self.transport = None
+        self.metrics = None
+        self._pending = collections.deque()
+        self._protocol = lirc.protocol.LircdProtocol()
+        self._sighup = False
+        self._exception = None
+
+    @property
+    def sighups(self):
+        ''' Number of received SIGHUP packets. '''
+        return self._protocol.sighups
+
+    async def connect(self):
+        ''' Connect to the lircd socket. '''
+        await _connect(lambda: _CommandProtocol(self), self.socket_path)
+
+    def send(self, cmd_string):
+        '''
+        Send a command string, return a future which eventually
+        holds the Reply or a lirc.client.BadPacketException.
+        '''
+        future = asyncio.get_running_loop().create_future()
+        if self._exception:
+            future.set_exception(self._exception)
+            return future
+        self._pending.append(future)
+        self.transport.write(cmd_string.encode("ascii"))
+        return future
+
+    async def run(self, command, timeout=None):
+        '''
+        Run a lirc.client.Command or a command string, return the Reply.
+        Raises lirc.client.TimeoutException if no complete reply is
+        received within timeout seconds.
+        '''
+        if isinstance(command, lirc.client.Command):
+            command = command.cmd_string
+        start = time.monotonic()
+        try:
+            reply = await asyncio.wait_for(self.send(command), timeout)
+        except asyncio.TimeoutError:
+            if self.metrics:
+                self.metrics.count("timeouts")
+            raise lirc.client.TimeoutException("No data from lircd host.")
+        if self.metrics:
+            self.metrics.observe(lirc.metrics.command_name(command),
+                                 time.monotonic() - start)
+        return reply
+
+    def data_received(self, data):
+        ''' Parse data received from lircd, resolve completed replies. '''
+        for event in self._protocol.feed(data):
+            if not isinstance(event, lirc.client.Reply):
+                continue
+            if event.sighup:
+                self._sighup = True
+                continue
+            if not self._pending:
+                continue
+            future = self._pending.popleft()
+            if future.done():
+                continue
+            if event.result == lirc.client.Result.FAIL:
+                future.set_exception(lirc.client.BadPacketException(
+                    "Cannot parse: %s" % event.last_line))
+            else:
+                event.sighup = self._sighup
+                self._sighup = False
+                future.set_result(event)
+
+    def connection_lost(self, exc):
+        ''' Fail all pending commands. '''
+        self._exception = exc or ConnectionResetError(
+            "lircd closed the connection.")
+        while self._pending:
+            future = self._pending.popleft()
+            if not future.done():
+                future.set_exception(self._exception)
+
+    def close(self):
+        ''' Close the transport. '''
+        if self.transport:
+            self.transport.close()
+
+    async def __aenter__(self):
+        ''' Implement enter async context manager, connecting. '''
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        ''' Implement exit async context manager. '''
+        self.close()
@@ -0,0 +1,499 @@
+''' Benchmarks for the client bindings using a fake lircd. '''
+##
+#   @file bench.py
+#   @brief Throughput, latency and memory for each client read path.
+#   @ingroup  python_bindings
+
+##  @addtogroup python_bindings
+#   @{
+
+##
+#
+#   Runs the client bindings against a lirc.fakelircd.FakeLircd and
+#   reports, for each read or command path:
+#
+#     - lines/s: Keypress lines (or command replies) handled per second.
+#     - p50, p99: Latency in ms from the server's write of a keypress to
+#       the client returning it, or the round trip time of a command.
+#     - peak KiB: Peak python memory allocated during the run, measured
+#       using tracemalloc in a second run of the same benchmark.
+#
+#   Usage:
+#
+#          python3 -m lirc.bench --count 100000 --burst 8
+#          python3 -m lirc.bench --rate 2000 raw-readline lircd-connection
+#
+#   Keypress latencies are sampled, by default for 10000 of the lines.
+#   Without --rate the server writes as fast as possible, so latencies
+#   then include time spent queued in the socket. The memory figures
+#   include the small allocations made by the server thread.
+#
+#   raw-readline-native reads using native=True, i. e. the socket opened
+#   by lirc_init() in the _client C extension, as a baseline for the
+#   native=False paths. connect-close and connect-close-native time
+#   creating and closing a RawConnection; lines/s is then connections
+#   per second. The native benchmarks are skipped if _client cannot be
+#   imported.
+#
+#   The local benchmarks run without a server. parse-reply-parser and
+#   parse-protocol feed the same stream of --commands replies, each
+#   followed by a keypress, in 4 KiB chunks to a ReplyParser for each
+#   reply and to a single lirc.protocol.LircdProtocol. Here lines/s is
+#   replies per second, p50 and p99 the time to parse a chunk.
+#
+#   db-no-cache, db-cold-cache and db-warm-cache load the configs
+#   directory given by --configs --loads times into a lirc.database
+#   Database and read all sections and configs: without cache_path, with
+#   a removed snapshot file which is rebuilt and with an existing one.
+#   lines/s is then loads per second, p50 and p99 the time of a load.
+#   They only run by default if --configs is given.
+#
+#          python3 -m lirc.bench --configs ../configs --loads 50 \
+#              db-no-cache db-cold-cache db-warm-cache
+
+# pylint: disable=unused-argument
+
+import argparse
+import asyncio
+import importlib.util
+import os
+import os.path
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import lirc.async_client
+import lirc.client
+import lirc.fakelircd
+import lirc.lircrc
+import lirc.protocol
+
+_BATCH = 64
+_CHUNK = 4096
+_REPLY = "BEGIN\nLIST fake\nSUCCESS\nDATA\n3\n" \
+    "0000000000000001 KEY_1\n0000000000000002 KEY_2\n" \
+    "0000000000000003 KEY_3\nEND\n0000000000000001 00 KEY_1 fake\n"
+_LIRCRC = '''
+begin
+    prog = bench
+    button = *
+    config = pressed
+    repeat = 1
+end
+'''
+
+
+class _Recorder(object):
+    '''
+    Counts received lines and records the receive time of sampled
+    sequence numbers. Attributes:
+      - count: Number of lines to read.
+      - sample_every: Sequence numbers sampled for latency.
+      - received: Number of lines read so far.
+      - latencies: List of latencies, seconds.
+    '''
+
+    def __init__(self, count, sample_every):
+        self.count = count
+        self.received = 0
+        self.latencies = []
+        self.sample_every = sample_every
+        self._times = {}
+
+    def add(self, count):
+        ''' Register count lines received now. '''
+        end = self.received + count
+        every = self.sample_every
+        seq = -(-self.received // every) * every
+        if seq < end:
+            now = time.perf_counter()
+            while seq < end:
+                self._times[seq] = now
+                seq += every
+        self.received = end
+
+    def done(self):
+        ''' Check if all lines are read. '''
+        return self.received >= self.count
+
+    def match(self, samples):
+        ''' Compute latencies from the server's sampled write times. '''
+        self.latencies = [self._times[seq] - sent
+                          for seq, sent in samples.items()
+                          if seq in self._times]
+
+
+def _raw_readline(socket_path, recorder, start):
+    ''' RawConnection.readline(). '''
+    conn = lirc.client.RawConnection(socket_path, native=False)
+    try:
+        start()
+        while not recorder.done():
+            conn.readline()
+            recorder.add(1)
+    finally:
+        conn.close()
+
+
+def _raw_readline_native(socket_path, recorder, start):
+    ''' RawConnection.readline() using the C extension. '''
+    conn = lirc.client.RawConnection(socket_path, native=True)
+    try:
+        start()
+        while not recorder.done():
+            conn.readline()
+            recorder.add(1)
+    finally:
+        conn.close()
+
+
+def _connect(socket_path, recorder, native):
+    ''' Time creating and closing RawConnection. '''
+    while not recorder.done():
+        before = time.perf_counter()
+        lirc.client.RawConnection(socket_path, native=native).close()
+        recorder.latencies.append(time.perf_counter() - before)
+        recorder.received += 1
+
+
+def _connect_close(socket_path, recorder, start):
+    ''' RawConnection() and close(). '''
+    _connect(socket_path, recorder, False)
+
+
+def _connect_close_native(socket_path, recorder, start):
+    ''' RawConnection() and close() using the C extension. '''
+    _connect(socket_path, recorder, True)
+
+
+def _raw_readlines(socket_path, recorder, start):
+    ''' RawConnection.readlines(). '''
+    conn = lirc.client.RawConnection(socket_path, native=False)
+    try:
+        start()
+        while not recorder.done():
+            recorder.add(len(conn.readlines()))
+    finally:
+        conn.close()
+
+
+def _raw_keypresses(socket_path, recorder, start):
+    ''' RawConnection.read_keypresses(). '''
+    conn = lirc.client.RawConnection(socket_path, native=False)
+    try:
+        start()
+        while not recorder.done():
+            recorder.add(len(conn.read_keypresses()))
+    finally:
+        conn.close()
+
+
+def _lircd_connection(socket_path, recorder, start):
+    ''' LircdConnection.readlines() using lirc.lircrc. '''
+    lircrc_path = os.path.join(os.path.dirname(socket_path), "lircrc")
+    with open(lircrc_path, "w") as f:
+        f.write(_LIRCRC)
+    conn = lirc.client.LircdConnection(
+        "bench", socket_path=socket_path,
+        lircrc=lirc.lircrc.Lircrc(lircrc_path, "bench"))
+    try:
+        start()
+        while not recorder.done():
+            recorder.add(len(conn.readlines()))
+    finally:
+        conn.close()
+
+
+def _async_connection(socket_path, recorder, start):
+    ''' AsyncConnection.readline(). '''
+
+    async def read():
+        ''' Read all lines. '''
+        conn = lirc.client.RawConnection(socket_path, native=False)
+        async with lirc.async_client.AsyncConnection(
+                conn, asyncio.get_running_loop()) as aconn:
+            start()
+            while not recorder.done():
+                await aconn.readline()
+                recorder.add(1)
+
+    asyncio.run(read())
+
+
+def _async_raw(socket_path, recorder, start):
+    ''' AsyncRawConnection.readline(). '''
+
+    async def read():
+        ''' Read all lines. '''
+        async with lirc.async_client.AsyncRawConnection(socket_path) as conn:
+            start()
+            while not recorder.done():
+                await conn.readline()
+                recorder.add(1)
+
+    asyncio.run(read())
+
+
+def _command_run(socket_path, recorder, start):
+    ''' Command.run(), one VERSION command at a time. '''
+    conn = lirc.client.CommandConnection(socket_path, native=False)
+    try:
+        while not recorder.done():
+            before = time.perf_counter()
+            lirc.client.VersionCommand(conn).run(5)
+            recorder.latencies.append(time.perf_counter() - before)
+            recorder.received += 1
+    finally:
+        conn.close()
+
+
+def _command_run_many(socket_path, recorder, start):
+    ''' CommandConnection.run_many(), batches of VERSION commands. '''
+    conn = lirc.client.CommandConnection(socket_path, native=False)
+    try:
+        while not recorder.done():
+            before = time.perf_counter()
+            conn.run_many(["VERSION\n"] * _BATCH, 5)
+            recorder.latencies.append(time.perf_counter() - before)
+            recorder.received += _BATCH
+    finally:
+        conn.close()
+
+
+def _async_command(socket_path, recorder, start):
+    ''' AsyncCommandConnection.run(), pipelined VERSION commands. '''
+
+    async def run(conn):
+        ''' Run a command, record latency. '''
+        before = time.perf_counter()
+        await conn.run(lirc.client.VersionCommand(conn), 5)
+        recorder.latencies.append(time.perf_counter() - before)
+
+    async def run_all():
+        ''' Run all commands. '''
+        async with lirc.async_client.AsyncCommandConnection(
+                socket_path) as conn:
+            while not recorder.done():
+                await asyncio.gather(*[run(conn) for _ in range(_BATCH)])
+                recorder.received += _BATCH
+
+    asyncio.run(run_all())
+
+
+def _chunks(count):
+    ''' Return count replies and keypresses as a list of 4 KiB chunks. '''
+    data = (_REPLY * count).encode("ascii")
+    return [data[i:i + _CHUNK] for i in range(0, len(data), _CHUNK)]
+
+
+def _parse_reply_parser(args, recorder, tmpdir):
+    ''' ReplyParser.feed(), splitting lines like CommandConnection. '''
+    parser = lirc.client.ReplyParser()
+    buf = b""
+    for chunk in _chunks(args.commands):
+        before = time.perf_counter()
+        lines = (buf + chunk).split(b"\n")
+        buf = lines.pop()
+        for line in lines:
+            parser.feed(line.decode("ascii", "ignore"))
+            if parser.is_completed():
+                recorder.received += 1
+                parser = lirc.client.ReplyParser()
+        recorder.latencies.append(time.perf_counter() - before)
+
+
+def _parse_protocol(args, recorder, tmpdir):
+    ''' LircdProtocol.feed(). '''
+    protocol = lirc.protocol.LircdProtocol()
+    for chunk in _chunks(args.commands):
+        before = time.perf_counter()
+        for event in protocol.feed(chunk):
+            if isinstance(event, lirc.client.Reply):
+                recorder.received += 1
+        recorder.latencies.append(time.perf_counter() - before)
+
+
+def _load_db(args, cache_path):
+    ''' Create a Database and read all of it, return seconds used. '''
+    # Imported here since lirc.database needs the yaml package.
+    import lirc.database
+    before = time.perf_counter()
+    db = lirc.database.Database(args.configs, cache_path=cache_path)
+    for key in ('drivers', 'kernel-drivers', 'lircd_by_driver'):
+        len(db.db[key])
+    list(db.configs.values())
+    return time.perf_counter() - before
+
+
+def _db_no_cache(args, recorder, tmpdir):
+    ''' Database() parsing all sources. '''
+    for _ in range(args.loads):
+        recorder.latencies.append(_load_db(args, None))
+        recorder.received += 1
+
+
+def _db_cold_cache(args, recorder, tmpdir):
+    ''' Database() parsing all sources and writing a new snapshot. '''
+    cache_path = os.path.join(tmpdir, "db.snapshot")
+    for _ in range(args.loads):
+        if os.path.exists(cache_path):
+            os.unlink(cache_path)
+        recorder.latencies.append(_load_db(args, cache_path))
+        recorder.received += 1
+
+
+def _db_warm_cache(args, recorder, tmpdir):
+    ''' Database() using an existing snapshot. '''
+    cache_path = os.path.join(tmpdir, "db.snapshot")
+    _load_db(args, cache_path)
+    for _ in range(args.loads):
+        recorder.latencies.append(_load_db(args, cache_path))
+        recorder.received += 1
+
+
+BENCHMARKS = [
+    ("raw-readline", _raw_readline, True),
+    ("raw-readline-native", _raw_readline_native, True),
+    ("raw-readlines", _raw_readlines, True),
+    ("raw-keypresses", _raw_keypresses, True),
+    ("lircd-connection", _lircd_connection, True),
+    ("async-connection", _async_connection, True),
+    ("async-raw", _async_raw, True),
+    ("command-run", _command_run, False),
+    ("command-run-many", _command_run_many, False),
+    ("async-command", _async_command, False),
+    ("connect-close", _connect_close, False),
+    ("connect-close-native", _connect_close_native, False),
+]
+_NATIVE = ("raw-readline-native", "connect-close-native")
+
+LOCAL_BENCHMARKS = [
+    ("parse-reply-parser", _parse_reply_parser),
+    ("parse-protocol", _parse_protocol),
+    ("db-no-cache", _db_no_cache),
+    ("db-cold-cache", _db_cold_cache),
+    ("db-warm-cache", _db_warm_cache),
+]
+
+
+def _run_once(reader, is_stream, args, socket_path):
+    ''' Run a benchmark, return (recorder, elapsed seconds). '''
+    count = args.count if is_stream else args.commands
+    recorder = _Recorder(count, max(1, count // args.samples))
+    lircd = lirc.fakelircd.FakeLircd(socket_path)
+    lircd.sample_every = recorder.sample_every
+    lircd.start()
+    sender = threading.Thread(
+        target=lircd.send_keypresses,
+        args=(count, args.rate, args.burst, args.repeats), daemon=True)
+
+    def start():
+        ''' Start sending when the reader is connected. '''
+        lircd.wait_for_clients(1)
+        sender.start()
+
+    try:
+        before = time.perf_counter()
+        reader(socket_path, recorder, start)
+        elapsed = time.perf_counter() - before
+        if is_stream:
+            sender.join()
+            recorder.match(lircd.samples)
+    finally:
+        lircd.close()
+    return recorder, elapsed
+
+
+def _percentile(values, fraction):
+    ''' Return the given percentile of values, in ms. '''
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] * 1000
+
+
+def _run_local(func, args, socket_path):
+    ''' Run a benchmark without server, return (recorder, elapsed). '''
+    recorder = _Recorder(0, 1)
+    before = time.perf_counter()
+    func(args, recorder, os.path.dirname(socket_path))
+    return recorder, time.perf_counter() - before
+
+
+def _names():
+    ''' Return names of all benchmarks. '''
+    return [b[0] for b in BENCHMARKS] + [b[0] for b in LOCAL_BENCHMARKS]
+
+
+def run(args):
+    ''' Run benchmarks selected in parsed command line args, print report.
+    '''
+    names = args.benchmarks \
+        or [n for n in _names() if args.configs or not n.startswith("db-")]
+    runners = [(name, lambda p, r=reader, s=is_stream:
+                _run_once(r, s, args, p))
+               for name, reader, is_stream in BENCHMARKS]
+    runners += [(name, lambda p, f=func: _run_local(f, args, p))
+                for name, func in LOCAL_BENCHMARKS]
+    tmpdir = tempfile.mkdtemp(prefix="lirc-bench-")
+    socket_path = os.path.join(tmpdir, "lircd.socket")
+    print("%-20s %12s %9s %9s %9s"
+          % ("benchmark", "lines/s", "p50 ms", "p99 ms", "peak KiB"))
+    try:
+        for name, runner in runners:
+            if name not in names:
+                continue
+            if name in _NATIVE \
+                    and importlib.util.find_spec("_client") is None:
+                print("%-20s skipped: no _client C extension" % name)
+                continue
+            recorder, elapsed = runner(socket_path)
+            tracemalloc.start()
+            runner(socket_path)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print("%-20s %12.0f %9.3f %9.3f %9.0f"
+                  % (name, recorder.received / elapsed,
+                     _percentile(recorder.latencies, 0.5),
+                     _percentile(recorder.latencies, 0.99), peak / 1024))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def main():
+    ''' Parse command line and run benchmarks. '''
+    parser = argparse.ArgumentParser(
+        description="Benchmark the lirc client bindings.")
+    parser.add_argument("benchmarks", nargs="*",
+                        help="Benchmarks to run, default all: "
+                        + ", ".join(_names()))
+    parser.add_argument("--count", type=int, default=100000,
+                        help="Keypress lines per stream benchmark")
+    parser.add_argument("--commands", type=int, default=10000,
+                        help="Commands per command or parse benchmark")
+    parser.add_argument("--rate", type=float, default=None,
+                        help="Max keypresses per second")
+    parser.add_argument("--burst", type=int, default=1,
+                        help="Keypresses per server write")
+    parser.add_argument("--repeats", type=int, default=0,
+                        help="Repeated lines per key")
+    parser.add_argument("--samples", type=int, default=10000,
+                        help="Number of latency samples")
+    parser.add_argument("--loads", type=int, default=20,
+                        help="Database loads per database benchmark")
+    parser.add_argument("--configs", default=None,
+                        help="configs directory for database benchmarks")
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in _names():
+            parser.error("Unknown benchmark: " + name)
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
+
+## @}
+#  python_bindings
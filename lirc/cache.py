@@ -0,0 +1,94 @@
+''' Cache for replies to read-only lircd commands. '''
+##
+#   @file cache.py
+#   @brief Cached LIST and VERSION replies, invalidated on SIGHUP.
+#   @ingroup  python_bindings
+
+##  @addtogroup python_bindings
+#   @{
+
+##
+#
+#   The replies to LIST and VERSION only change when lircd reloads its
+#   configuration, which it announces using a SIGHUP packet to all
+#   clients. The ReplyCache runs such commands once and then returns the
+#   cached Reply until a SIGHUP is seen. The API is unstable.
+#
+#          conn = lirc.client.CommandConnection()
+#          cache = lirc.cache.ReplyCache(conn, ttl=300)
+#          reply = cache.run(lirc.client.ListRemotesCommand(conn))
+#
+#   SIGHUP packets are detected by all reply parsers in the process, see
+#   lirc.client.sighup_count(), so a SIGHUP seen on any connection
+#   invalidates the cache. Before using a cached reply, data already sent
+#   by lircd on the cache's connection is checked for a SIGHUP without
+#   waiting.
+#
+#   Other commands are passed through to the connection uncached.
+
+import time
+
+import lirc.client
+
+_CACHEABLE = ("LIST", "VERSION")
+
+
+class ReplyCache(object):
+    '''
+    Caching command runner. Parameters:
+      - connection: A lirc.client.CommandConnection.
+      - ttl: If not None, max age in seconds of a cached reply.
+
+    The attributes hits and misses count cache lookups.
+    '''
+
+    def __init__(self, connection, ttl=None):
+        self.hits = 0
+        self.misses = 0
+        self._conn = connection
+        self._ttl = ttl
+        self._cache = {}
+        self._generation = lirc.client.sighup_count()
+
+    def _check_sighup(self):
+        ''' Check data already received for SIGHUP, flush if changed. '''
+        if self._cache:
+            for line in self._conn.readlines(timeout=0):
+                if line.strip() == "SIGHUP":
+                    lirc.client.note_sighup()
+        if self._generation != lirc.client.sighup_count():
+            self.flush()
+
+    def flush(self):
+        ''' Remove all cached replies. '''
+        self._cache.clear()
+        self._generation = lirc.client.sighup_count()
+
+    def run(self, command, timeout=None):
+        '''
+        Run a lirc.client.Command or a command string and return the
+        Reply, cached if possible. timeout as for Command.run().
+        '''
+        if isinstance(command, lirc.client.Command):
+            cmd_string = command.cmd_string
+        else:
+            cmd_string = command
+            command = lirc.client.Command(cmd_string, self._conn)
+        if cmd_string.split(None, 1)[0] not in _CACHEABLE:
+            return command.run(timeout)
+        self._check_sighup()
+        if cmd_string in self._cache:
+            reply, when = self._cache[cmd_string]
+            if self._ttl is None or time.monotonic() - when < self._ttl:
+                self.hits += 1
+                return reply
+        self.misses += 1
+        reply = command.run(timeout)
+        if self._generation != lirc.client.sighup_count():
+            self.flush()
+        if reply.success:
+            self._cache[cmd_string] = (reply, time.monotonic())
+        return reply
+
+## @}
+#  python_bindings
@@ -32,6 +32,25 @@
 #       - A hardcoded default like /run/lirc/lircd
 #   Returns a code string as documented in lircd(8)
 #
+#   Using native=False the socket is opened directly in python, without
+#   loading the C extension or calling lirc_init(). This is enough when
+#   only raw keypresses are read, and is also usable on hosts lacking
+#   lirc_client. The recv_size argument sets the size of the preallocated
+#   receive buffer.
+#
+#   The socket_path can also be a tcp://host:port address of a lircd
+#   started with --listen, or an already connected socket. See lirc.tcp.
+#
+#   read_keypress() and read_keypresses() return the same data parsed
+#   into Keypress tuples with integer code and repeat count.
+#
+#   When many codes arrive at once, e.g. during repeat storms, readlines()
+#   returns all complete code strings from a single wakeup:
+#
+#          for batch in conn.iter_batches():
+#              for keypress in batch:
+#                  ... do something with keypress
+#
 #
 #   Reading lircrc-translated data.
 #   -------------------------------
@@ -51,6 +70,10 @@
 #         get_default_lircrc_path() for defaults if omitted.
 #       - socket_path: See RawConnection above.
 #
+#   Using the lircrc argument, translations are made by a pure python
+#   lirc.lircrc.Lircrc instance instead of lirc_code2char(). See
+#   lircrc.py.
+#
 #
 #   Sending data
 #   ------------
@@ -83,6 +106,14 @@
 #           print(command.parser.data[0])
 #
 #
+#   A batch of commands can be sent in a single write using
+#
+#       replies = conn.run_many([lirc.client.ListKeysCommand(conn, r)
+#                                for r in remotes])
+#
+#   The replies are returned in the same order as the commands.
+#
+#
 #   Non-blocking IO
 #   ---------------
 #
@@ -109,6 +140,7 @@
 #   @{
 
 
+import collections
 import configparser
 from enum import Enum
 import os
@@ -119,9 +151,19 @@ import sys
 import time
 
 import lirc.config
-import _client
+import lirc.metrics
+import lirc.tcp
+
+try:
+    import _client
+except ImportError:
+    _client = None
 
 _DEFAULT_PROG = "lircd-client"
+_KEYPRESS_CACHE_SIZE = 4096
+_keypress_cache = {}
+_code_cache = {}
+_sighup_count = 0
 
 
 def get_default_socket_path():
@@ -173,6 +215,20 @@ def get_default_lircrc_path():
     return os.path.join(lirc.config.SYSCONFDIR, "lirc", "lircrc")
 
 
+def note_sighup():
+    ''' Register a SIGHUP packet, called by the reply parsers. '''
+    global _sighup_count        # pylint: disable=global-statement
+    _sighup_count += 1
+
+
+def sighup_count():
+    '''
+    Return the number of SIGHUP packets seen by any reply parser in this
+    process. A changed value means lircd has reloaded its configuration.
+    '''
+    return _sighup_count
+
+
 class BadPacketException(Exception):
     ''' Malformed or otherwise unparsable packet received. '''
     pass
@@ -187,26 +243,137 @@ class TimeoutException(Exception):
 #  @defgroup receiving Classes to receive keypresses
 #  @{
 
+class Keypress(collections.namedtuple('Keypress', 'code repeat key remote')):
+    '''
+    A parsed code string as described in lircd(8). Attributes:
+      - code: int, the decoded IR code.
+      - repeat: int, the repeat count, 0 for the initial press.
+      - key: string, interned button name.
+      - remote: string, interned remote name.
+    '''
+    __slots__ = ()
+
+
+_tuple_new = tuple.__new__
+
+
+def parse_keypress(line):
+    '''
+    Parse a code string into a Keypress. Identical lines return the same
+    cached object. The decoded code and interned names are also cached
+    keyed on the line without the repeat count, so a new repeat count of
+    a known button just decodes the count and builds the tuple.
+    '''
+    keypress = _keypress_cache.get(line)
+    if keypress is not None:
+        return keypress
+    try:
+        code, repeat, names = line.split(None, 2)
+        cached = _code_cache.get((code, names))
+        if cached is None:
+            key, remote = names.split()
+            cached = (int(code, 16), sys.intern(key), sys.intern(remote))
+            if len(_code_cache) >= _KEYPRESS_CACHE_SIZE:
+                _code_cache.clear()
+            _code_cache[(code, names)] = cached
+        keypress = _tuple_new(
+            Keypress, (cached[0], int(repeat, 16), cached[1], cached[2]))
+    except ValueError:
+        raise BadPacketException("Cannot parse code string: " + line)
+    if len(_keypress_cache) >= _KEYPRESS_CACHE_SIZE:
+        _keypress_cache.clear()
+    _keypress_cache[line] = keypress
+    return keypress
+
+
 class RawConnection(object):
     '''
     Interface to receive raw keypresses. Parameters:
       - socket_path: lircd output socket path, see get_default_socket_path()
-        for defaults.
+        for defaults. Also a tcp:// address or a connected socket, see
+        lirc.tcp.
       - prog: Program name used in lircrc decoding, see ircat(1). Could be
         omitted if only raw keypresses should be read.
+      - native: If True, open the socket using lirc_init() in the C
+        extension. If False, connect to the socket directly without
+        using the extension or touching the environment.
+      - recv_size: Size of the preallocated receive buffer.
+
+    The metrics attribute is None or a lirc.metrics.Metrics recording
+    reads, lines and buffer size.
     '''
     # pylint: disable=no-member
 
-    def __init__(self, socket_path=None, prog=_DEFAULT_PROG):
-        if socket_path:
+    def __init__(self, socket_path=None, prog=_DEFAULT_PROG,
+                 native=True, recv_size=4096):
+        if not socket_path:
+            socket_path = get_default_socket_path()
+        self.metrics = None
+        if isinstance(socket_path, socket.socket) \
+                or lirc.tcp.is_tcp_address(socket_path):
+            native = False
+        self._native = native
+        if isinstance(socket_path, socket.socket):
+            self._socket = socket_path
+        elif lirc.tcp.is_tcp_address(socket_path):
+            self._socket = lirc.tcp.connect(socket_path)
+        elif native:
+            if _client is None:
+                raise ImportError("Cannot import the _client C extension.")
             os.environ["LIRC_SOCKET_PATH"] = socket_path
+            fd = _client.lirc_init(prog)
+            self._socket = \
+                socket.fromfd(fd, socket.AF_UNIX, socket.SOCK_STREAM)
         else:
-            os.environ["LIRC_SOCKET_PATH"] = get_default_socket_path()
-        fd = _client.lirc_init(prog)
-        self._socket = socket.fromfd(fd, socket.AF_UNIX, socket.SOCK_STREAM)
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                self._socket.connect(socket_path)
+            except OSError:
+                self._socket.close()
+                raise
         self._select = selectors.DefaultSelector()
         self._select.register(self._socket, selectors.EVENT_READ)
+        self._recv_buffer = memoryview(bytearray(recv_size))
         self._buffer = bytearray(0)
+        self._pos = 0
+
+    def _recv(self):
+        ''' Receive available data into the buffer, return byte count. '''
+        if self._pos >= len(self._buffer):
+            del self._buffer[:]
+            self._pos = 0
+        elif self._pos > len(self._recv_buffer):
+            del self._buffer[:self._pos]
+            self._pos = 0
+        nbytes = self._socket.recv_into(self._recv_buffer)
+        self._buffer += self._recv_buffer[:nbytes]
+        if self.metrics:
+            self.metrics.count("recv_calls")
+            self.metrics.count("bytes", nbytes)
+            self.metrics.gauge("buffered", len(self._buffer) - self._pos)
+        return nbytes
+
+    def _fill(self, timeout):
+        '''
+        Receive data until a complete line is buffered. Returns index of
+        the first newline, or -1 on timeout (see readline()).
+        '''
+        if timeout:
+            start = time.monotonic()
+        while True:
+            if timeout is not None and timeout > 0:
+                to = start + timeout - time.monotonic()
+            else:
+                to = timeout
+            ready = self._select.select(to)
+            if ready == []:
+                return -1
+            scanned = len(self._buffer) - self._pos
+            if self._recv() == 0:
+                raise ConnectionResetError("lircd closed the connection.")
+            ix = self._buffer.find(b'\n', self._pos + scanned)
+            if ix >= 0:
+                return ix
 
     def readline(self, timeout=None):
         '''
@@ -216,19 +383,69 @@ class RawConnection(object):
               - if set to None (default mode) use blocking read.
           - Returns: code string as described in lircd(8) or None.
         '''
-        if timeout:
-            start = time.clock()
-        while b'\n' not in self._buffer:
-            if timeout is not None and timeout > 0:
-                to = start + timeout - time.clock()
-            else:
-                to = timeout
-            ready = self._select.select(to)
-            if ready == []:
+        ix = self._buffer.find(b'\n', self._pos)
+        if ix < 0:
+            ix = self._fill(timeout)
+            if ix < 0:
                 return None
-            self._buffer += self._socket.recv(4096)
-        line, self._buffer = self._buffer.split(b'\n', 1)
-        return line.decode("ascii", "ignore")
+        line = self._buffer[self._pos:ix].decode("ascii", "ignore")
+        self._pos = ix + 1
+        if self.metrics:
+            self.metrics.count("lines")
+        return line
+
+    def readlines(self, max_lines=None, timeout=None):
+        '''
+        Read all complete code strings available after at most one wait.
+          - max_lines: If given, return at most this many strings, leaving
+            the rest buffered.
+          - timeout: As for readline().
+          - Returns: List of code strings, empty on timeout.
+        '''
+        if self._buffer.find(b'\n', self._pos) < 0:
+            if self._fill(timeout) < 0:
+                return []
+        end = self._buffer.rfind(b'\n', self._pos)
+        if max_lines:
+            ix = self._pos - 1
+            for _ in range(max_lines):
+                ix = self._buffer.find(b'\n', ix + 1)
+                if ix < 0 or ix == end:
+                    break
+            else:
+                end = ix
+        lines = self._buffer[self._pos:end].decode("ascii", "ignore")
+        self._pos = end + 1
+        lines = lines.split("\n")
+        if self.metrics:
+            self.metrics.count("lines", len(lines))
+        return lines
+
+    def iter_batches(self, max_lines=None, timeout=None):
+        '''
+        Iterate over lists of code strings as returned by readlines().
+        Iteration stops when a read times out.
+        '''
+        while True:
+            lines = self.readlines(max_lines, timeout)
+            if not lines:
+                return
+            yield lines
+
+    def read_keypress(self, timeout=None):
+        '''
+        Read a code string parsed into a Keypress, see parse_keypress().
+        timeout as for readline(); returns None on timeout.
+        '''
+        line = self.readline(timeout)
+        if line is None:
+            return None
+        return parse_keypress(line)
+
+    def read_keypresses(self, max_lines=None, timeout=None):
+        ''' Like readlines(), but returns a list of parsed Keypress. '''
+        return [parse_keypress(line)
+                for line in self.readlines(max_lines, timeout)]
 
     def fileno(self):
         ''' Return the file nr used for IO, suitable for select() etc. '''
@@ -236,12 +453,14 @@ class RawConnection(object):
 
     def has_data(self):
         ''' Check if at least one code string is available. '''
-        return b'\n' in self._buffer
+        return self._buffer.find(b'\n', self._pos) >= 0
 
     def close(self):
         ''' Close socket connection. '''
         self._socket.close()
-        _client.lirc_deinit()
+        self._select.close()
+        if self._native:
+            _client.lirc_deinit()
 
 
 class LircdConnection(object):
@@ -252,37 +471,118 @@ class LircdConnection(object):
 
     Parameters:
       - program: string, used to identify client. See ircat(1)
-      - lircrc: lircrc file path. See get_default_lircrc_path() for defaults.
+      - lircrc_path: lircrc file path. See get_default_lircrc_path() for
+        defaults.
       - socket_path: lircd output socket path,  see get_default_socket_path()
        for defaults.
+      - lircrc: Optional lirc.lircrc.Lircrc instance. If given, it's used
+        for the translations instead of the C library and lircrc_path is
+        ignored.
+
+    The metrics attribute is the one of the underlying RawConnection,
+    see lirc.metrics.
     '''
     # pylint: disable=no-member
 
-    def __init__(self, program, lircrc_path=None, socket_path=None):
+    def __init__(self, program, lircrc_path=None, socket_path=None,
+                 lircrc=None):
+        self._program = program
+        self._buffer = collections.deque()
+        self._translator = lircrc
+        if lircrc:
+            self._connection = RawConnection(socket_path, program,
+                                             native=False)
+            self._lircrc = None
+            return
         if not lircrc_path:
             lircrc_path = get_default_lircrc_path()
         if not lircrc_path:
             raise FileNotFoundError("Cannot find lircrc config file.")
         self._connection = RawConnection(socket_path, program)
         self._lircrc = _client.lirc_readconfig(lircrc_path)
-        self._program = program
-        self._buffer = []
+        self._lircrc_path = lircrc_path
+
+    @property
+    def metrics(self):
+        ''' The lirc.metrics.Metrics of the connection, or None. '''
+        return self._connection.metrics
+
+    @metrics.setter
+    def metrics(self, metrics):
+        ''' Set lirc.metrics.Metrics for this and the raw connection. '''
+        self._connection.metrics = metrics
+
+    def _translate(self, code):
+        ''' Return list of strings translated from code. '''
+        if self._translator:
+            return self._translator.translate(code)
+        return _client.lirc_code2char(self._lircrc, self._program, code)
 
     def readline(self, timeout=None):
         '''
         Read translated keypress string. timeout as for
         RawConnection.readline()
         '''
-        while len(self._buffer) <= 0:
+        while not self._buffer:
             code = self._connection.readline(timeout)
             if code is None:
                 return None
-            strings = \
-                _client.lirc_code2char(self._lircrc, self._program, code)
-            if not strings or len(strings) == 0:
-                continue
-            self._buffer.extend(strings)
-        return self._buffer.pop(0)
+            strings = self._translate(code)
+            if strings:
+                self._buffer.extend(strings)
+        if self._connection.metrics:
+            self._connection.metrics.count("translated")
+        return self._buffer.popleft()
+
+    def _translate_all(self, codes):
+        ''' Translate a list of code strings, add results to buffer. '''
+        for code in codes:
+            strings = self._translate(code)
+            if strings:
+                self._buffer.extend(strings)
+
+    def readlines(self, timeout=None):
+        '''
+        Return all available translated strings: the buffered ones and
+        the translations of all code strings already received by the
+        underlying RawConnection. If nothing is available, wait as for
+        readline(). Returns a list, empty on timeout.
+        '''
+        while not self._buffer:
+            codes = self._connection.readlines(timeout=timeout)
+            if not codes:
+                return []
+            self._translate_all(codes)
+        if self._connection.has_data():
+            self._translate_all(self._connection.readlines())
+        lines = list(self._buffer)
+        self._buffer.clear()
+        if self._connection.metrics:
+            self._connection.metrics.count("translated", len(lines))
+        return lines
+
+    def iter_batches(self, timeout=None):
+        '''
+        Iterate over lists of translated strings as returned by
+        readlines(). Iteration stops when a read times out.
+        '''
+        while True:
+            lines = self.readlines(timeout)
+            if not lines:
+                return
+            yield lines
+
+    def reload_lircrc(self):
+        '''
+        Re-read the lircrc file, keeping the socket connection. The new
+        translations replace the old ones in a single step.
+        '''
+        if self._translator:
+            self._translator.reload()
+            return
+        old = self._lircrc
+        self._lircrc = _client.lirc_readconfig(self._lircrc_path)
+        _client.lirc_freeconfig(old)
 
     def has_data(self):
         ''' Check if at least one translated string is available. '''
@@ -295,7 +595,8 @@ class LircdConnection(object):
     def close(self):
         ''' Close socket connection. '''
         self._connection.close()
-        _client.lirc_freeconfig(self._lircrc)
+        if self._lircrc:
+            _client.lirc_freeconfig(self._lircrc)
 
 ## @}
 
@@ -307,8 +608,8 @@ class LircdConnection(object):
 class CommandConnection(RawConnection):
     ''' Extends the parent with a send() method. '''
 
-    def __init__(self, _socket=None):
-        RawConnection.__init__(self, _socket)
+    def __init__(self, _socket=None, native=True):
+        RawConnection.__init__(self, _socket, native=native)
 
     def send(self, command):
         ''' Send  single line over socket '''
@@ -318,6 +619,45 @@ class CommandConnection(RawConnection):
             sent = self._socket.send(command)
             command = command[sent:]
 
+    def run_many(self, commands, timeout=None):
+        '''
+        Send a batch of commands in one write and parse the replies in
+        order. Returns a list of Reply, one for each command.
+          - commands: Command objects and/or command strings.
+          - timeout: As for readline(), used for each read. Raises
+            TimeoutException if no data is available in time.
+
+        Errors are reported per command: a reply with ERROR status has
+        success == False, an unparsable reply has result == Result.FAIL.
+        '''
+        parsers = []
+        cmd_strings = []
+        for command in commands:
+            if isinstance(command, Command):
+                parsers.append(command.parser)
+                cmd_strings.append(command.cmd_string)
+            else:
+                parsers.append(ReplyParser())
+                cmd_strings.append(command)
+        start = time.monotonic()
+        self.send("".join(cmd_strings))
+        for parser, cmd_string in zip(parsers, cmd_strings):
+            while not parser.is_completed():
+                line = self.readline(timeout)
+                if line is None:
+                    if self.metrics:
+                        self.metrics.count("timeouts")
+                    raise TimeoutException("No data from lircd host.")
+                try:
+                    parser.feed(line)
+                except BadPacketException:
+                    parser.result = Result.FAIL
+                    parser.success = False
+            if self.metrics:
+                self.metrics.observe(lirc.metrics.command_name(cmd_string),
+                                     time.monotonic() - start)
+        return parsers
+
 
 class Result(Enum):
     ''' Public reply parser result, available when completed. '''
@@ -334,14 +674,35 @@ class Command(object):
         self._cmd_string = cmd_string
         self._parser = ReplyParser()
 
+    @property
+    def cmd_string(self):
+        ''' The command string sent to lircd. '''
+        return self._cmd_string
+
+    @property
+    def parser(self):
+        ''' The ReplyParser used to parse the reply. '''
+        return self._parser
+
     def run(self, timeout=None):
-        ''' Run the command and return a Reply. '''
+        '''
+        Run the command and return a Reply. The round trip time is
+        recorded if the connection has metrics, see lirc.metrics.
+        '''
+        metrics = getattr(self._conn, "metrics", None)
+        if metrics:
+            start = time.monotonic()
         self._conn.send(self._cmd_string)
         while not self._parser.is_completed():
             line = self._conn.readline(timeout)
             if not line:
+                if metrics:
+                    metrics.count("timeouts")
                 raise TimeoutException("No data from lircd host.")
             self._parser.feed(line)
+        if metrics:
+            metrics.observe(lirc.metrics.command_name(self._cmd_string),
+                            time.monotonic() - start)
         return self._parser
 
 
@@ -371,15 +732,7 @@ class ReplyParser(Reply):
         self._state = self._State.BEGIN
         self._lines_expected = None
         self._buffer = bytearray(0)
-
-    def is_completed(self):
-        ''' Returns true if no more reply input is required. '''
-        return self.result != Result.INCOMPLETE
-
-    def feed(self, line):
-        ''' Enter a line of data into parsing FSM, update state. '''
-
-        fsm = {
+        self._fsm = {
             self._State.BEGIN: self._begin,
             self._State.COMMAND: self._command,
             self._State.RESULT: self._result,
@@ -389,11 +742,19 @@ class ReplyParser(Reply):
             self._State.END: self._end,
             self._State.SIGHUP_END: self._sighup_end
         }
+
+    def is_completed(self):
+        ''' Returns true if no more reply input is required. '''
+        return self.result != Result.INCOMPLETE
+
+    def feed(self, line):
+        ''' Enter a line of data into parsing FSM, update state. '''
+
         line = line.strip()
         if not line:
             return
         self.last_line = line
-        fsm[self._state](line)
+        self._fsm[self._state](line)
         if self._state == self._State.DONE:
             self.result = Result.OK
 
@@ -426,7 +787,12 @@ class ReplyParser(Reply):
     def _command(self, line):
         if not line:
             self._bad_packet_exception(line)
-        self._state = self._State.RESULT
+        if line == "SIGHUP":
+            self._state = self._State.SIGHUP_END
+            self.sighup = True
+            note_sighup()
+        else:
+            self._state = self._State.RESULT
 
     def _result(self, line):
         if line in ["SUCCESS", "ERROR"]:
@@ -435,6 +801,7 @@ class ReplyParser(Reply):
         elif line == "SIGHUP":
             self._state = self._State.SIGHUP_END
             self.sighup = True
+            note_sighup()
         else:
             self._bad_packet_exception(line)
 
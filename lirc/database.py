@@ -14,7 +14,10 @@
 # The database is loaded from some YAML files:
 #
 #   - kernel-drivers.yaml: Static Info on the kernel drivers. Availability
-#     of these drivers is checked in runtime before being imported into db.
+#     of these drivers is checked in runtime before being imported into db,
+#     using the modules.dep, modules.builtin and modules.alias index files
+#     for the running kernel (or modinfo(8) if not available). See
+#     KernelModules.
 #   - drivers.yaml, Info on the userspace drivers, collected from their
 #     compiled information by configs/Makefile using lirc-lsplugins(1).
 #   - confs_by_driver.yaml: Mapping of drivers -> suggested remote files,
@@ -28,6 +31,23 @@
 # Although python cannot guarantee this, the database is designed as a
 # read-only structure.
 #
+# Parsing the yaml files is slow. Using the cache_path argument, the parsed
+# data is saved as a snapshot file which is used by later instances as
+# long as the source files (paths, mtimes and sizes) and the running kernel
+# are unchanged. Otherwise the snapshot is rebuilt.
+#
+# Without a snapshot the data is loaded lazily: each section (drivers,
+# kernel drivers, configs...) is parsed on first access, and each config
+# file is parsed only when used. Looking up a config by id reads just that
+# file.
+#
+# Lookups use indexes built on first use: remote -> driver and, for each
+# config key queried, value -> configs. query() filters configs on several
+# keys at once, optionally using prefix matching:
+#
+#          db.query(driver='default', menu='home_brew')
+#          db.query(prefix=True, label='Samsung')
+#
 # Simple usage examples lives in doc/: data2hwdb and data2table. The
 # lirc-setup script provides a more elaborated example. Data structures
 # are basically documented in the yaml files.
@@ -36,9 +56,14 @@
 #   @{
 
 
+import bisect
+import collections.abc
+import concurrent.futures
 import glob
 import os
 import os.path
+import pickle
+import re
 import subprocess
 import sys
 
@@ -54,32 +79,370 @@ available as a pypi package at https://pypi.python.org/pypi/PyYAML.'''
 
 import config
 
+_PLAIN_ID_REGEX = re.compile(r'^[\w.+-]+$')
+_RESOLVER = yaml.resolver.Resolver()
+_STR_TAG = 'tag:yaml.org,2002:str'
+
 
 def _here(path):
     ''' Return path added to current dir for __file__. '''
     return os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
 
 
-def _load_kerneldrivers(configdir):
+def _module_name(path):
+    ''' Return normalized module name for a modules.dep path. '''
+    name = os.path.basename(path).split('.ko', 1)[0]
+    return name.replace('-', '_')
+
+
+def _modinfo_ok(driver):
+    ''' Check if modinfo finds given module. '''
+    with open('/dev/null', 'w') as f:
+        try:
+            subprocess.check_output([config.MODINFO, driver], stderr=f)
+        except (subprocess.CalledProcessError, OSError):
+            return False
+    return True
+
+
+class KernelModules(object):
+    '''
+    Kernel module availability checker. Reads modules.dep, modules.builtin
+    and modules.alias once and answers all lookups from this index.
+    If there is no modules.dep, lookups fall back to running modinfo
+    for each module. Parameters:
+      - root: Modules root directory, defaults to /lib/modules.
+      - release: Kernel release, defaults to the running kernel.
+      - probe_workers: Max number of modinfo processes run in parallel
+        by the fallback.
+    '''
+
+    def __init__(self, root='/lib/modules', release=None, probe_workers=1):
+        self.path = os.path.join(root, release or os.uname().release)
+        self.probe_workers = probe_workers
+        self._names = None
+
+    @property
+    def has_index(self):
+        ''' True if modules.dep exists, i. e., the index is usable. '''
+        return os.path.exists(os.path.join(self.path, 'modules.dep'))
+
+    def _load(self):
+        ''' Read the index files into a set of names. '''
+        names = set()
+        with open(os.path.join(self.path, 'modules.dep')) as f:
+            for line in f:
+                names.add(_module_name(line.split(':', 1)[0]))
+        try:
+            with open(os.path.join(self.path, 'modules.builtin')) as f:
+                for line in f:
+                    names.add(_module_name(line.strip()))
+        except FileNotFoundError:
+            pass
+        modules = set(names)
+        try:
+            with open(os.path.join(self.path, 'modules.alias')) as f:
+                for line in f:
+                    words = line.split()
+                    if len(words) == 3 and words[0] == 'alias' \
+                            and _module_name(words[2]) in modules:
+                        names.add(words[1].replace('-', '_'))
+        except FileNotFoundError:
+            pass
+        self._names = names
+
+    def available(self, modules):
+        ''' Return the set of available modules in given list. '''
+        if self.has_index:
+            if self._names is None:
+                self._load()
+            return set(m for m in modules
+                       if m.replace('-', '_') in self._names)
+        if self.probe_workers > 1:
+            with concurrent.futures.ThreadPoolExecutor(
+                    self.probe_workers) as executor:
+                found = executor.map(_modinfo_ok, modules)
+                return set(m for m, ok in zip(modules, found) if ok)
+        return set(m for m in modules if _modinfo_ok(m))
+
+    def is_available(self, module):
+        ''' Check if a single module is available. '''
+        return bool(self.available([module]))
+
+
+def _load_kerneldrivers(configdir, modules=None):
     ''' Parse the kerneldrivers.yaml file, discard unavailable
-    drivers.
+    drivers. modules is a KernelModules, by default for running kernel.
     '''
 
     with open(os.path.join(configdir, "kernel-drivers.yaml")) as f:
         cf = yaml.load(f.read())
+    if not modules:
+        modules = KernelModules()
     drivers = cf['drivers'].copy()
+    found = modules.available([d for d in drivers if d != 'default'])
     for driver in cf['drivers']:
-        if driver == 'default':
+        if driver != 'default' and driver not in found:
+            del drivers[driver]
+    return drivers
+
+
+def _load_confs_by_driver(yamlpath):
+    ''' Return the lircd_by_driver and lircmd_by_driver dicts. '''
+    with open(os.path.join(yamlpath, "confs_by_driver.yaml")) as f:
+        cf = yaml.load(f.read())
+    return cf['lircd_by_driver'].copy(), cf['lircmd_by_driver'].copy()
+
+
+def _load_drivers(kernel_drivers, yamlpath):
+    ''' Return kernel_drivers + drivers.yaml with cleaned up hints. '''
+    drivers = kernel_drivers.copy()
+    with open(os.path.join(yamlpath, "drivers.yaml")) as f:
+        cf = yaml.load(f.read())
+    drivers.update(cf['drivers'].copy())
+    for key, d in drivers.items():
+        d['id'] = key
+        hint = d['device_hint']
+        if not hint:
             continue
-        with open('/dev/null', 'w') as f:
-            try:
-                subprocess.check_output([config.MODINFO, driver],
-                                        stderr=f)
-            except subprocess.CalledProcessError:
-                del drivers[driver]
+        hint = hint.strip()
+        if hint.startswith('"') and hint.endswith('"'):
+            hint = hint[1:-1]
+            hint = hint.replace(r'\"', "@$#!")
+            hint = hint.replace('"', '')
+            hint = hint.replace("@$#!", '"')
+            hint = hint.replace("\\\\", "\\")
+        d['device_hint'] = hint
     return drivers
 
 
+def _load_config(path):
+    ''' Parse a *.conf file, return the config dict. '''
+    with open(path) as f:
+        cf = yaml.load(f.read())
+    return cf['config']
+
+
+def _load_db(configdir, yamlpath, modules):
+    ''' Parse all source files, return the complete db dictionary. '''
+    db = {}
+    db['lircd_by_driver'], db['lircmd_by_driver'] = \
+        _load_confs_by_driver(yamlpath)
+    db['kernel-drivers'] = _load_kerneldrivers(configdir, modules)
+    db['drivers'] = _load_drivers(db['kernel-drivers'], yamlpath)
+    configs = {}
+    for path in glob.glob(configdir + '/*.conf'):
+        conf = _load_config(path)
+        configs[conf['id']] = conf
+    db['configs'] = configs
+    return db
+
+
+def _scan_id(text):
+    '''
+    Return the config id in the text of a *.conf file, parsed as YAML
+    does, or None if not found using a plain text scan.
+    '''
+    indent = None
+    value = None
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped or stripped.startswith('#'):
+            continue
+        level = len(line) - len(line.lstrip())
+        if indent is None:
+            if level == 0 and stripped.split('#')[0].strip() == 'config:':
+                indent = 0
+            continue
+        if level == 0:
+            break
+        if indent == 0:
+            indent = level
+        if level == indent and stripped.startswith('id:'):
+            value = stripped[len('id:'):].strip()
+    if not value:
+        return None
+    if _PLAIN_ID_REGEX.match(value) and _RESOLVER.resolve(
+            yaml.ScalarNode, value, (True, False)) == _STR_TAG:
+        return value
+    try:
+        return yaml.safe_load(value)
+    except yaml.YAMLError:
+        return None
+
+
+class _LazyConfigs(collections.abc.Mapping):
+    '''
+    The configs dict, parsing each *.conf file on first access. The ids
+    are found using a plain text scan of the 'id:' line in each file.
+    If a parsed file has another id all files are parsed and re-keyed.
+    '''
+
+    def __init__(self, configdir):
+        self._paths = {}
+        self._configs = {}
+        for path in glob.glob(configdir + '/*.conf'):
+            with open(path) as f:
+                conf_id = _scan_id(f.read())
+            if isinstance(conf_id, str):
+                self._paths[conf_id] = path
+            else:
+                conf = _load_config(path)
+                self._configs[conf['id']] = conf
+
+    def _load_all(self):
+        ''' Parse all remaining files, keying them by the parsed id. '''
+        paths = self._paths
+        self._paths = {}
+        for path in paths.values():
+            conf = _load_config(path)
+            self._configs[conf['id']] = conf
+
+    def __getitem__(self, key):
+        try:
+            return self._configs[key]
+        except KeyError:
+            pass
+        conf = _load_config(self._paths[key])
+        if conf['id'] != key:
+            self._load_all()
+            return self._configs[key]
+        del self._paths[key]
+        self._configs[key] = conf
+        return conf
+
+    def __iter__(self):
+        return iter(self._paths.keys() | self._configs.keys())
+
+    def __len__(self):
+        return len(self._paths.keys() | self._configs.keys())
+
+
+class _LazyDb(dict):
+    '''
+    The db dictionary, loading each section on first access. Methods
+    looking at all keys or values load all sections.
+    '''
+
+    _SECTIONS = ('lircd_by_driver', 'lircmd_by_driver', 'kernel-drivers',
+                 'drivers', 'configs')
+
+    def __init__(self, configdir, yamlpath, modules):
+        dict.__init__(self)
+        self._configdir = configdir
+        self._yamlpath = yamlpath
+        self._modules = modules
+
+    def __missing__(self, key):
+        if key in ['lircd_by_driver', 'lircmd_by_driver']:
+            self['lircd_by_driver'], self['lircmd_by_driver'] = \
+                _load_confs_by_driver(self._yamlpath)
+        elif key == 'kernel-drivers':
+            self[key] = _load_kerneldrivers(self._configdir, self._modules)
+        elif key == 'drivers':
+            self[key] = _load_drivers(self['kernel-drivers'], self._yamlpath)
+        elif key == 'configs':
+            self[key] = _LazyConfigs(self._configdir)
+        else:
+            raise KeyError(key)
+        return dict.__getitem__(self, key)
+
+    def _load_all(self):
+        ''' Load all sections not yet loaded. '''
+        for key in self._SECTIONS:
+            self[key]       # pylint: disable=pointless-statement
+
+    def __contains__(self, key):
+        return key in self._SECTIONS or dict.__contains__(self, key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __iter__(self):
+        self._load_all()
+        return dict.__iter__(self)
+
+    def __len__(self):
+        self._load_all()
+        return dict.__len__(self)
+
+    def __eq__(self, other):
+        self._load_all()
+        return dict.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        self._load_all()
+        return dict.__repr__(self)
+
+    def keys(self):
+        self._load_all()
+        return dict.keys(self)
+
+    def values(self):
+        self._load_all()
+        return dict.values(self)
+
+    def items(self):
+        self._load_all()
+        return dict.items(self)
+
+    def copy(self):
+        self._load_all()
+        return dict(self)
+
+
+def _snapshot_key(configdir, yamlpath, modules):
+    '''
+    Return data identifying the sources of a snapshot: paths, mtimes and
+    sizes of all files, the kernel modules dir and index and the modinfo
+    path (kernel drivers availability).
+    '''
+    paths = [os.path.join(yamlpath, "confs_by_driver.yaml"),
+             os.path.join(yamlpath, "drivers.yaml"),
+             os.path.join(configdir, "kernel-drivers.yaml")]
+    paths.extend(sorted(glob.glob(configdir + '/*.conf')))
+    if modules.has_index:
+        paths.append(os.path.join(modules.path, 'modules.dep'))
+    key = [modules.path, config.MODINFO]
+    for path in paths:
+        st = os.stat(path)
+        key.append((path, st.st_mtime_ns, st.st_size))
+    return key
+
+
+def _read_snapshot(cache_path, key):
+    ''' Return db stored in cache_path if valid for key, else None. '''
+    try:
+        with open(cache_path, 'rb') as f:
+            cached_key, db = pickle.load(f)
+    except (OSError, EOFError, ValueError, TypeError,
+            pickle.UnpicklingError):
+        return None
+    return db if cached_key == key else None
+
+
+def _write_snapshot(cache_path, key, db):
+    ''' Store db in cache_path, ignoring errors. '''
+    tmp_path = "%s.%d.tmp" % (cache_path, os.getpid())
+    try:
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((key, db), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+
+
 class ItemLookupError(Exception):
     """A lookup failed, either too namy or no matches found. """
     pass
@@ -112,9 +475,19 @@ class Config(object):
 
 
 class Database(object):
-    ''' Reflects the *.yaml files in the configs/ directory. '''
+    '''
+    Reflects the *.yaml files in the configs/ directory. Parameters:
+      - path: configs directory, see module docs for defaults.
+      - yamlpath: Directory with the *.yaml files, defaults to path.
+      - cache_path: If given, a snapshot of the parsed data is stored in
+        this file and used instead of parsing the sources as long as
+        they are unchanged.
+      - modules: KernelModules used to check kernel drivers, defaults to
+        the running kernel's modules.
+    '''
 
-    def __init__(self, path=None, yamlpath=None):
+    def __init__(self, path=None, yamlpath=None, cache_path=None,
+                 modules=None):
 
         if path and os.path.exists(path):
             configdir = path
@@ -131,37 +504,20 @@ class Database(object):
             raise FileNotFoundError(where)
         if not yamlpath:
             yamlpath = configdir
-        db = {}
-        with open(os.path.join(yamlpath, "confs_by_driver.yaml")) as f:
-            cf = yaml.load(f.read())
-        db['lircd_by_driver'] = cf['lircd_by_driver'].copy()
-        db['lircmd_by_driver'] = cf['lircmd_by_driver'].copy()
-
-        db['kernel-drivers'] = _load_kerneldrivers(configdir)
-        db['drivers'] = db['kernel-drivers'].copy()
-        with open(os.path.join(yamlpath, "drivers.yaml")) as f:
-            cf = yaml.load(f.read())
-        db['drivers'].update(cf['drivers'].copy())
-        for key, d in db['drivers'].items():
-            d['id'] = key
-            hint = d['device_hint']
-            if not hint:
-                continue
-            hint = hint.strip()
-            if hint.startswith('"') and hint.endswith('"'):
-                hint = hint[1:-1]
-                hint = hint.replace(r'\"', "@$#!")
-                hint = hint.replace('"', '')
-                hint = hint.replace("@$#!", '"')
-                hint = hint.replace("\\\\", "\\")
-            d['device_hint'] = hint
-
-        configs = {}
-        for path in glob.glob(configdir + '/*.conf'):
-            with open(path) as f:
-                cf = yaml.load(f.read())
-            configs[cf['config']['id']] = cf['config']
-        db['configs'] = configs
+        if not modules:
+            modules = KernelModules()
+        self._indexes = {}
+        self._unindexed = {}
+        self._sorted_values = {}
+        self._remote_index = None
+        if not cache_path:
+            self.db = _LazyDb(configdir, yamlpath, modules)
+            return
+        key = _snapshot_key(configdir, yamlpath, modules)
+        db = _read_snapshot(cache_path, key)
+        if db is None:
+            db = _load_db(configdir, yamlpath, modules)
+            _write_snapshot(cache_path, key, db)
         self.db = db
 
     @property
@@ -177,7 +533,11 @@ class Database(object):
 
     @property
     def configs(self):
-        ''' Return dict of parsed config/*.conf files, keyd by id. '''
+        '''
+        Return dict of parsed config/*.conf files, keyd by id. Without
+        cache_path this is a read-only Mapping parsing each file on first
+        access, not a dict; use dict(db.configs) for a copy.
+        '''
         return self.db['configs']
 
     def remotes_by_driver(self, driver):
@@ -200,15 +560,99 @@ class Database(object):
 
     def driver_by_remote(self, remote):
         ''' Return the driver (possibly None) suggested for a remote. '''
-        for driver, files in self.db['lircd_by_driver'].items():
-            if remote in files:
-                return self.db['drivers'][driver]
-        return None
+        if self._remote_index is None:
+            index = {}
+            for driver, files in self.db['lircd_by_driver'].items():
+                for f in files:
+                    index.setdefault(f, driver)
+            self._remote_index = index
+        try:
+            return self.db['drivers'][self._remote_index[remote]]
+        except KeyError:
+            return None
+
+    def _index(self, key):
+        '''
+        Return dict of config[key] values -> list of config ids. Ids of
+        configs with unhashable values are kept in _unindexed[key].
+        '''
+        try:
+            return self._indexes[key]
+        except KeyError:
+            pass
+        index = {}
+        unindexed = []
+        for conf_id, conf in self.db['configs'].items():
+            try:
+                index.setdefault(conf[key], []).append(conf_id)
+            except KeyError:
+                pass
+            except TypeError:
+                unindexed.append(conf_id)
+        self._indexes[key] = index
+        self._unindexed[key] = unindexed
+        return index
+
+    def _equal_ids(self, key, value):
+        ''' Return set of config ids where config[key] == value. '''
+        configs = self.db['configs']
+        index = self._index(key)
+        try:
+            found = set(index.get(value, ()))
+        except TypeError:
+            return set([i for i, conf in configs.items()
+                        if conf.get(key) == value])
+        found.update([i for i in self._unindexed[key]
+                      if configs[i][key] == value])
+        return found
+
+    def _match_ids(self, key, value, prefix=False):
+        ''' Return set of config ids where config[key] matches value. '''
+        if key == 'id' and not prefix:
+            try:
+                return {value} if value in self.db['configs'] else set()
+            except TypeError:
+                return set()
+        if not prefix:
+            return self._equal_ids(key, value)
+        if key not in self._sorted_values:
+            if key == 'id':
+                values = list(self.db['configs'])
+            else:
+                values = [v for v in self._index(key) if isinstance(v, str)]
+            self._sorted_values[key] = sorted(values)
+        values = self._sorted_values[key]
+        found = set()
+        for i in range(bisect.bisect_left(values, value), len(values)):
+            if not values[i].startswith(value):
+                break
+            if key == 'id':
+                found.add(values[i])
+            else:
+                found.update(self._index(key)[values[i]])
+        return found
+
+    def query(self, prefix=False, **criteria):
+        '''
+        Return list of configs matching all key=value criteria, sorted by
+        id, e.g. query(driver='default', menu='home_brew'). If prefix is
+        True a string value matches all configs where config[key] starts
+        with it.
+        '''
+        found = None
+        for key, value in criteria.items():
+            ids = self._match_ids(key, value, prefix)
+            found = ids if found is None else found & ids
+            if not found:
+                return []
+        if found is None:
+            found = self.db['configs'].keys()
+        return [self.db['configs'][i] for i in sorted(found)]
 
     def find_config(self, key, value):
         ''' Return item (a config) in configs where config[key] == value. '''
-        found = [c for c in self.db['configs'].values()
-                 if key in c and c[key] == value]
+        found = [self.db['configs'][i]
+                 for i in sorted(self._match_ids(key, value))]
         if len(found) > 1:
             raise ItemLookupError(
                 "find_config: Too many matches for %s, %s): " % (key, value)
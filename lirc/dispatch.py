@@ -0,0 +1,254 @@
+''' Route keypresses and lircrc strings to handlers. '''
+##
+#   @file dispatch.py
+#   @brief Per-key handler dispatch, inline, in threads or asyncio tasks.
+#   @ingroup  python_bindings
+
+##  @addtogroup python_bindings
+#   @{
+
+##
+#
+#   A Dispatcher maps buttons, i e. (remote, key), and translated lircrc
+#   strings to handlers, replacing the if/elif chains in the read loop.
+#   The API is unstable.
+#
+#          dispatcher = lirc.dispatch.Dispatcher(max_workers=4)
+#          dispatcher.on_key("Samsung", "KEY_UP", volume_up)
+#          dispatcher.on_string("mute", lirc.dispatch.Handler(
+#              mute, mode=lirc.dispatch.Mode.THREAD, limit=1))
+#          dispatcher.run(lirc.client.RawConnection(socket_path))
+#
+#   Routing is a dict lookup on the line for lircrc strings, otherwise
+#   on (remote, key) and (None, key) for buttons registered for any
+#   remote. Code strings are parsed only if no string route matches.
+#   dispatch() accepts lines from both RawConnection and LircdConnection;
+#   dispatch_keypress() accepts lirc.client.Keypress and
+#   lirc.events.KeyEvent.
+#
+#   Each Handler runs in one of the modes:
+#     - INLINE: Called directly by dispatch(), blocking it.
+#     - THREAD: Called in the dispatcher's thread pool.
+#     - ASYNC: The handler is a coroutine function, run as a task in the
+#       dispatcher's event loop. dispatch() may be called from any
+#       thread.
+#
+#   With THREAD and ASYNC, dispatch() returns without waiting for the
+#   handler, so slow handlers do not delay reading. A Handler's limit is
+#   the max number of concurrently running calls; calls beyond that are
+#   dropped and counted in the handler's dropped attribute, rather than
+#   queued behind the slow ones. Exceptions raised by handlers are
+#   counted in errors and the last one is kept in error.
+
+import asyncio
+import concurrent.futures
+from enum import Enum
+import threading
+
+import lirc.client
+
+
+class Mode(Enum):
+    ''' How a Handler is run. '''
+    INLINE = 1
+    THREAD = 2
+    ASYNC = 3
+
+
+class Handler(object):
+    '''
+    A callback and how to run it. Parameters:
+      - callback: Called with the dispatched string or keypress.
+      - mode: Mode.
+      - limit: Max number of concurrent calls, None for no limit.
+
+    Attributes:
+      - running: Number of calls in progress.
+      - dropped: Number of calls skipped due to limit.
+      - errors, error: Number of failed calls and the last exception.
+    '''
+
+    def __init__(self, callback, mode=Mode.INLINE, limit=None):
+        self.callback = callback
+        self.mode = mode
+        self.limit = limit
+        self.running = 0
+        self.dropped = 0
+        self.errors = 0
+        self.error = None
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        ''' Reserve a call slot, return False if limit is reached. '''
+        with self._lock:
+            if self.limit is not None and self.running >= self.limit:
+                self.dropped += 1
+                return False
+            self.running += 1
+            return True
+
+    def release(self, error=None):
+        ''' Free a call slot, record error if not None. '''
+        with self._lock:
+            self.running -= 1
+            if error is not None:
+                self.errors += 1
+                self.error = error
+
+    def call(self, item):
+        ''' Run callback synchronously, releasing the slot afterwards. '''
+        try:
+            self.callback(item)
+        except Exception as ex:            # pylint: disable=broad-except
+            self.release(ex)
+            return
+        self.release()
+
+    async def call_async(self, item):
+        ''' Await coroutine callback, releasing the slot afterwards. '''
+        try:
+            await self.callback(item)
+        except Exception as ex:            # pylint: disable=broad-except
+            self.release(ex)
+            return
+        self.release()
+
+
+class Dispatcher(object):
+    '''
+    Routes lines and keypresses to handlers. Parameters:
+      - max_workers: Thread pool size for Mode.THREAD handlers.
+      - loop: Event loop for Mode.ASYNC handlers, by default the loop
+        running when the first such handler is registered.
+
+    The attribute unrouted counts items without a handler.
+    '''
+
+    def __init__(self, max_workers=4, loop=None):
+        self.unrouted = 0
+        self._max_workers = max_workers
+        self._loop = loop
+        self._executor = None
+        self._routes = {}
+        self._default = None
+        self._running = False
+
+    def _handler(self, handler):
+        ''' Return handler as a Handler, preparing its mode. '''
+        if not isinstance(handler, Handler):
+            handler = Handler(handler)
+        if handler.mode == Mode.THREAD and not self._executor:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                self._max_workers, thread_name_prefix="lirc-dispatch")
+        elif handler.mode == Mode.ASYNC and not self._loop:
+            self._loop = asyncio.get_running_loop()
+        return handler
+
+    def on_key(self, remote, key, handler):
+        '''
+        Route keypresses for key on remote to handler, a Handler or a
+        plain function run inline. If remote is None, key is routed for
+        all remotes without a more specific route.
+        '''
+        self._routes[(remote, key)] = self._handler(handler)
+
+    def on_string(self, string, handler):
+        ''' Route a translated lircrc string to handler, see on_key(). '''
+        self._routes[string] = self._handler(handler)
+
+    def on_default(self, handler):
+        ''' Set handler for items without a route, None to remove. '''
+        self._default = self._handler(handler) if handler else None
+
+    def remove(self, route):
+        ''' Remove a route, a string or a (remote, key) tuple. '''
+        self._routes.pop(route, None)
+
+    def _run(self, handler, item):
+        ''' Run handler for item according to its mode. '''
+        if not handler.acquire():
+            return
+        if handler.mode == Mode.INLINE:
+            handler.call(item)
+        elif handler.mode == Mode.THREAD:
+            self._executor.submit(handler.call, item)
+        else:
+            try:
+                in_loop = asyncio.get_running_loop() is self._loop
+            except RuntimeError:
+                in_loop = False
+            if in_loop:
+                self._loop.create_task(handler.call_async(item))
+            else:
+                asyncio.run_coroutine_threadsafe(
+                    handler.call_async(item), self._loop)
+
+    def _unrouted(self, item):
+        ''' Handle an item without route. '''
+        self.unrouted += 1
+        if self._default:
+            self._run(self._default, item)
+
+    def dispatch_keypress(self, keypress):
+        '''
+        Run the handler for a keypress, anything with key and remote
+        attributes. Returns False if there is no route.
+        '''
+        routes = self._routes
+        handler = routes.get((keypress.remote, keypress.key)) \
+            or routes.get((None, keypress.key))
+        if handler is None:
+            self._unrouted(keypress)
+            return False
+        self._run(handler, keypress)
+        return True
+
+    def dispatch(self, line):
+        '''
+        Run the handler for a translated lircrc string or a code string
+        as returned by RawConnection.readline(), the latter parsed into
+        a lirc.client.Keypress. Returns False if there is no route.
+        '''
+        handler = self._routes.get(line)
+        if handler is not None:
+            self._run(handler, line)
+            return True
+        try:
+            keypress = lirc.client.parse_keypress(line)
+        except lirc.client.BadPacketException:
+            self._unrouted(line)
+            return False
+        return self.dispatch_keypress(keypress)
+
+    def pump(self, connection, timeout=0):
+        '''
+        Dispatch all lines available from connection, waiting as for
+        RawConnection.readlines(). Returns number of lines.
+        '''
+        lines = connection.readlines(timeout=timeout)
+        for line in lines:
+            self.dispatch(line)
+        return len(lines)
+
+    def run(self, connection):
+        '''
+        Dispatch lines from a RawConnection or LircdConnection until
+        stop() is called or the connection fails.
+        '''
+        self._running = True
+        while self._running:
+            self.pump(connection, 0.2)
+
+    def stop(self):
+        ''' Make run() return. '''
+        self._running = False
+
+    def close(self, wait=True):
+        ''' Stop, and shut down the thread pool. '''
+        self.stop()
+        if self._executor:
+            self._executor.shutdown(wait)
+            self._executor = None
+
+## @}
+#  python_bindings
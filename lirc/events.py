@@ -0,0 +1,235 @@
+''' Press, hold and release events from the keypress stream. '''
+##
+#   @file events.py
+#   @brief Turn repeated code strings into press/hold/release events.
+#   @ingroup  python_bindings
+
+##  @addtogroup python_bindings
+#   @{
+
+##
+#
+#   While a button is held down lircd sends a code string for each IR
+#   frame, typically 10 per second or more, with an increasing repeat
+#   count. The EventEngine turns this stream into events proportional to
+#   what the user does:
+#
+#     - PRESS when a button is pressed.
+#     - HOLD while it's held down, rate limited: the first one after
+#       hold_delay seconds, then each hold_interval seconds. The interval
+#       is multiplied by acceleration after each HOLD, but not below
+#       min_interval.
+#     - RELEASE when no frame has been received for release_timeout
+#       seconds, or when another button on the same remote is pressed.
+#
+#   Frames not generating an event are just counted in coalesced. All
+#   times are from time.monotonic(). The API is unstable.
+#
+#   The engine does no IO, and can be fed from any source. EventReader
+#   reads from a RawConnection, waking up in time to deliver RELEASE:
+#
+#          conn = lirc.client.RawConnection(socket_path, native=False)
+#          reader = lirc.events.EventReader(conn, lirc.events.EventEngine(
+#              hold_delay=0.4, hold_interval=0.2, acceleration=0.8))
+#          while True:
+#              for event in reader.read_events():
+#                  if event.type == lirc.events.EventType.PRESS:
+#                      ... do something with event.key
+#
+#   Other loops feed keypresses using feed() or feed_lines(), and call
+#   poll() when timeout() seconds have passed without data.
+
+import collections
+from enum import Enum
+import time
+
+import lirc.client
+
+
+class EventType(Enum):
+    ''' Type of KeyEvent. '''
+    PRESS = 1
+    HOLD = 2
+    RELEASE = 3
+
+
+class KeyEvent(collections.namedtuple(
+        'KeyEvent', 'type key remote repeat time duration')):
+    '''
+    An event from EventEngine:
+      - type: EventType.
+      - key, remote: Button and remote names.
+      - repeat: The repeat count of the last frame.
+      - time: time.monotonic() timestamp of the event.
+      - duration: Seconds since the button was pressed.
+    '''
+    __slots__ = ()
+
+
+class _KeyState(object):
+    ''' A button being held down. '''
+    # pylint: disable=too-few-public-methods
+
+    __slots__ = ('key', 'remote', 'repeat', 'pressed', 'last',
+                 'next_hold', 'interval')
+
+    def __init__(self, keypress, now, hold_delay, hold_interval):
+        self.key = keypress.key
+        self.remote = keypress.remote
+        self.repeat = keypress.repeat
+        self.pressed = now
+        self.last = now
+        self.next_hold = now + hold_delay
+        self.interval = hold_interval
+
+    def event(self, event_type, now):
+        ''' Return a KeyEvent of given type for this button. '''
+        return KeyEvent(event_type, self.key, self.remote, self.repeat,
+                        now, now - self.pressed)
+
+
+class EventEngine(object):
+    '''
+    Turns keypresses into KeyEvent. Parameters, all in seconds except
+    acceleration, see module docs:
+      - release_timeout: Max time between frames of a held button.
+      - hold_delay: Time from PRESS to first HOLD.
+      - hold_interval: Initial time between HOLD events.
+      - acceleration: Factor applied to the interval after each HOLD.
+      - min_interval: Lower limit for the accelerated interval.
+
+    Attributes:
+      - coalesced: Number of frames absorbed without an event.
+      - bad_lines: Number of unparsable code strings in feed_lines().
+    '''
+    # pylint: disable=too-many-arguments
+
+    def __init__(self, release_timeout=0.2, hold_delay=0.5,
+                 hold_interval=0.2, acceleration=1.0, min_interval=0.05):
+        self.release_timeout = release_timeout
+        self.hold_delay = hold_delay
+        self.hold_interval = hold_interval
+        self.acceleration = acceleration
+        self.min_interval = min_interval
+        self.coalesced = 0
+        self.bad_lines = 0
+        self._down = {}
+
+    def _release(self, ident, now, events):
+        ''' Add RELEASE event for a held button. '''
+        events.append(self._down.pop(ident).event(EventType.RELEASE, now))
+
+    def _press(self, keypress, now, events):
+        ''' Add PRESS event, releasing other buttons on same remote. '''
+        for ident in [i for i in self._down if i[0] == keypress.remote]:
+            self._release(ident, now, events)
+        state = _KeyState(keypress, now, self.hold_delay, self.hold_interval)
+        self._down[(keypress.remote, keypress.key)] = state
+        events.append(state.event(EventType.PRESS, now))
+
+    def feed(self, keypress, now=None):
+        '''
+        Enter a lirc.client.Keypress received at now (default: current
+        time.monotonic()), return list of resulting events.
+        '''
+        if now is None:
+            now = time.monotonic()
+        events = self.poll(now) if self._down else []
+        state = self._down.get((keypress.remote, keypress.key))
+        if state is None or keypress.repeat == 0:
+            self._press(keypress, now, events)
+            return events
+        state.last = now
+        state.repeat = keypress.repeat
+        if now < state.next_hold:
+            self.coalesced += 1
+            return events
+        events.append(state.event(EventType.HOLD, now))
+        state.interval = \
+            max(self.min_interval, state.interval * self.acceleration)
+        state.next_hold = now + state.interval
+        return events
+
+    def feed_lines(self, lines, now=None):
+        '''
+        Enter a list of code strings as returned by
+        RawConnection.readlines(), return list of resulting events.
+        '''
+        if now is None:
+            now = time.monotonic()
+        events = []
+        for line in lines:
+            try:
+                keypress = lirc.client.parse_keypress(line)
+            except lirc.client.BadPacketException:
+                self.bad_lines += 1
+                continue
+            events.extend(self.feed(keypress, now))
+        return events
+
+    def poll(self, now=None):
+        ''' Return list of RELEASE events due at now (default: current). '''
+        if now is None:
+            now = time.monotonic()
+        events = []
+        for ident, state in list(self._down.items()):
+            if now - state.last >= self.release_timeout:
+                self._release(ident, now, events)
+        return events
+
+    def timeout(self, now=None):
+        '''
+        Return seconds until next RELEASE is due, or None if no button
+        is held down.
+        '''
+        if not self._down:
+            return None
+        if now is None:
+            now = time.monotonic()
+        due = min(s.last for s in self._down.values()) + self.release_timeout
+        return max(0.0, due - now)
+
+
+class EventReader(object):
+    '''
+    Reads KeyEvent from a connection. Parameters:
+      - connection: A lirc.client.RawConnection or anything else with
+        a readlines(timeout=...) method returning code strings.
+      - engine: The EventEngine, by default one using default settings.
+    '''
+
+    def __init__(self, connection, engine=None):
+        self.engine = engine or EventEngine()
+        self._conn = connection
+
+    def read_events(self, timeout=None):
+        '''
+        Return list of available events, waiting at most timeout seconds
+        (None: forever) for at least one. Returns [] on timeout.
+        '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.engine.timeout()
+            if deadline is not None:
+                left = max(0.0, deadline - time.monotonic())
+                wait = left if wait is None else min(wait, left)
+            lines = self._conn.readlines(timeout=wait)
+            if lines:
+                events = self.engine.feed_lines(lines)
+            else:
+                events = self.engine.poll()
+            if events:
+                return events
+            if deadline is not None and time.monotonic() >= deadline:
+                return []
+
+    def fileno(self):
+        ''' Return the file nr used for IO, suitable for select() etc. '''
+        return self._conn.fileno()
+
+    def close(self):
+        ''' Close the connection. '''
+        self._conn.close()
+
+## @}
+#  python_bindings
@@ -0,0 +1,317 @@
+''' A fake lircd server for tests and benchmarks. '''
+##
+#   @file fakelircd.py
+#   @brief Stand-in lircd serving the socket protocol without hardware.
+#   @ingroup  python_bindings
+
+##  @addtogroup python_bindings
+#   @{
+
+##
+#
+#   The FakeLircd serves the lircd socket protocol on a unix socket, so
+#   the client bindings can be exercised without lircd and IR hardware.
+#   It runs in a thread, answers commands from all clients and sends
+#   generated keypress streams to all of them. The API is unstable.
+#
+#          with lirc.fakelircd.FakeLircd("/tmp/lircd.sock") as lircd:
+#              conn = lirc.client.RawConnection("/tmp/lircd.sock",
+#                                               native=False)
+#              lircd.wait_for_clients(1)
+#              lircd.send_keypresses(1000, rate=100, burst=4)
+#              ... read 1000 lines from conn.
+#
+#   Commands are answered like lircd does: VERSION, LIST, SEND_ONCE,
+#   SEND_START, SEND_STOP, SIMULATE, SET_TRANSMITTERS, DRV_OPTION and
+#   SET_INPUTLOG are handled for the remotes given to the constructor,
+#   other commands get an ERROR reply. SIMULATE sends the simulated
+#   keypress to all clients. SIGHUP packets are sent by inject_sighup(),
+#   or after each sighup_every commands.
+#
+#   Keypresses are numbered; the code of each is its sequence number.
+#   The attribute sample_every makes send_keypresses() record the time
+#   each sequence number divisible by it was written in the samples
+#   dict, which is used by lirc.bench for latency measurements.
+#
+#   Using a tcp://host:port address instead of a path the server listens
+#   on TCP like lircd --listen. Port 0 picks a free port; socket_path is
+#   then updated with the actual one.
+#
+#   The server can also be run from the command line, see
+#   python3 -m lirc.fakelircd --help.
+
+import argparse
+import os
+import selectors
+import socket
+import threading
+import time
+
+import lirc.tcp
+
+_VERSION = "0.10.0-fake"
+_SIGHUP = b"BEGIN\nSIGHUP\nEND\n"
+
+
+def _default_remotes():
+    ''' Return the remotes used if none are given. '''
+    return {"fake": ["KEY_%d" % i for i in range(10)]
+                    + ["KEY_UP", "KEY_DOWN", "KEY_OK", "KEY_POWER"]}
+
+
+class FakeLircd(object):
+    '''
+    Serves the lircd socket protocol on a unix socket. Parameters:
+      - socket_path: Path to the socket, replaced if it exists, or a
+        tcp:// address.
+      - remotes: Dict of remote name -> list of key names, used in
+        replies and generated keypresses.
+      - sighup_every: If not None, send a SIGHUP packet to all clients
+        after each sighup_every commands.
+
+    Attributes:
+      - commands: Number of commands handled.
+      - keypresses: Number of keypresses sent.
+      - sample_every, samples: See module docs.
+    '''
+
+    def __init__(self, socket_path, remotes=None, sighup_every=None):
+        self.socket_path = socket_path
+        self.remotes = remotes or _default_remotes()
+        self.sighup_every = sighup_every
+        self.commands = 0
+        self.keypresses = 0
+        self.sample_every = 0
+        self.samples = {}
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._joined = threading.Condition(self._lock)
+        self._running = False
+        self._thread = None
+        if lirc.tcp.is_tcp_address(socket_path):
+            self._listen_tcp(socket_path)
+        else:
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+            self._listener = \
+                socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._listener.bind(socket_path)
+        self._listener.listen(64)
+        self._select = selectors.DefaultSelector()
+        self._select.register(self._listener, selectors.EVENT_READ)
+
+    def _listen_tcp(self, address):
+        ''' Bind listener to a tcp:// address, update socket_path. '''
+        host, port = lirc.tcp.parse_address(address)
+        family = socket.AF_INET6 if ":" in host else socket.AF_INET
+        self._listener = socket.socket(family, socket.SOCK_STREAM)
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind((host, port))
+        port = self._listener.getsockname()[1]
+        if family == socket.AF_INET6:
+            host = "[%s]" % host
+        self.socket_path = "tcp://%s:%d" % (host, port)
+
+    def start(self):
+        ''' Start serving in a daemon thread. '''
+        self._running = True
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        ''' Stop the serving thread, if running. '''
+        self._running = False
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        ''' Stop, close all client connections and remove the socket. '''
+        self.stop()
+        with self._lock:
+            for sock in self._clients:
+                sock.close()
+            self._clients.clear()
+        self._select.close()
+        self._listener.close()
+        if not lirc.tcp.is_tcp_address(self.socket_path):
+            os.unlink(self.socket_path)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+
+    def wait_for_clients(self, count, timeout=5):
+        ''' Wait until count clients are connected, return False on timeout.
+        '''
+        with self._joined:
+            return self._joined.wait_for(
+                lambda: len(self._clients) >= count, timeout)
+
+    def _serve(self):
+        ''' Thread body: accept clients and answer commands. '''
+        while self._running:
+            for key, _ in self._select.select(0.1):
+                if key.fileobj is self._listener:
+                    sock, _ = self._listener.accept()
+                    if sock.family != socket.AF_UNIX:
+                        lirc.tcp.configure(sock)
+                    self._select.register(sock, selectors.EVENT_READ)
+                    with self._joined:
+                        self._clients[sock] = bytearray(0)
+                        self._joined.notify_all()
+                else:
+                    self._read(key.fileobj)
+
+    def _drop(self, sock):
+        ''' Forget a closed client. Caller holds the lock. '''
+        if sock in self._clients:
+            del self._clients[sock]
+            self._select.unregister(sock)
+            sock.close()
+
+    def _read(self, sock):
+        ''' Read and answer commands from a client. '''
+        try:
+            data = sock.recv(4096)
+        except OSError:
+            data = b""
+        with self._lock:
+            if not data:
+                self._drop(sock)
+                return
+            buf = self._clients[sock]
+            buf += data
+            end = buf.rfind(b"\n")
+            if end < 0:
+                return
+            lines = buf[:end].decode("ascii", "ignore").split("\n")
+            del buf[:end + 1]
+        replies = [self._reply(line.strip()) for line in lines
+                   if line.strip()]
+        self._write([sock], "".join(replies).encode("ascii"))
+        if self.sighup_every and replies:
+            first = self.commands - len(replies)
+            if self.commands // self.sighup_every \
+                    != first // self.sighup_every:
+                self.inject_sighup()
+
+    def _reply(self, line):
+        ''' Return the reply packet for a command line. '''
+        self.commands += 1
+        words = line.split()
+        command = words[0].upper()
+        success = True
+        data = []
+        if command == "VERSION":
+            data = [_VERSION]
+        elif command == "LIST":
+            if len(words) == 1:
+                data = list(self.remotes)
+            elif words[1] in self.remotes:
+                data = ["%016x %s" % (i, key) for i, key
+                        in enumerate(self.remotes[words[1]])]
+            else:
+                success = False
+                data = ["unknown remote: \"%s\"" % words[1]]
+        elif command in ("SEND_ONCE", "SEND_START", "SEND_STOP"):
+            if len(words) < 3 or words[1] not in self.remotes \
+                    or words[2] not in self.remotes[words[1]]:
+                success = False
+                data = ["unknown remote or key: " + line]
+        elif command == "SIMULATE" and len(words) == 5:
+            self._write(list(self._clients),
+                        (" ".join(words[1:]) + "\n").encode("ascii"))
+        elif command not in ("SET_TRANSMITTERS", "DRV_OPTION",
+                             "SET_INPUTLOG"):
+            success = False
+            data = ["unknown command: \"%s\"" % command]
+        reply = "BEGIN\n%s\n%s\n" % (line, "SUCCESS" if success else "ERROR")
+        if data:
+            reply += "DATA\n%d\n%s\n" % (len(data), "\n".join(data))
+        return reply + "END\n"
+
+    def _write(self, socks, data):
+        ''' Send data to given clients, dropping failing ones. '''
+        with self._lock:
+            for sock in socks:
+                if sock not in self._clients:
+                    continue
+                try:
+                    sock.sendall(data)
+                except OSError:
+                    self._drop(sock)
+
+    def inject_sighup(self):
+        ''' Send a SIGHUP packet to all clients. '''
+        self._write(list(self._clients), _SIGHUP)
+
+    def send_keypresses(self, count, rate=None, burst=1, repeats=0):
+        '''
+        Send count keypress lines to all clients, return when done.
+          - rate: Max keypresses per second, None: as fast as possible.
+          - burst: Number of keypresses written at once.
+          - repeats: Each key is sent repeats + 1 times with increasing
+            repeat count, like a held down button.
+        '''
+        names = [(key, remote) for remote, keys in self.remotes.items()
+                 for key in keys]
+        start = time.perf_counter()
+        for first in range(0, count, burst):
+            last = min(first + burst, count)
+            if rate:
+                delay = start + first / rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            lines = []
+            for seq in range(self.keypresses, self.keypresses + last - first):
+                key, remote = names[seq // (repeats + 1) % len(names)]
+                lines.append("%016x %02x %s %s\n"
+                             % (seq, seq % (repeats + 1), key, remote))
+            now = time.perf_counter()
+            self._write(list(self._clients), "".join(lines).encode("ascii"))
+            if self.sample_every:
+                seq = -(-self.keypresses // self.sample_every) \
+                    * self.sample_every
+                while seq < self.keypresses + last - first:
+                    self.samples[seq] = now
+                    seq += self.sample_every
+            self.keypresses += last - first
+
+
+def main():
+    ''' Run a FakeLircd from the command line. '''
+    parser = argparse.ArgumentParser(
+        description="Fake lircd serving the socket protocol.")
+    parser.add_argument("socket", help="Unix socket path or tcp:// address")
+    parser.add_argument("--count", type=int, default=0,
+                        help="Keypresses to send to first client")
+    parser.add_argument("--rate", type=float, default=None,
+                        help="Max keypresses per second")
+    parser.add_argument("--burst", type=int, default=1,
+                        help="Keypresses per write")
+    parser.add_argument("--repeats", type=int, default=0,
+                        help="Repeated lines per key")
+    parser.add_argument("--sighup-every", type=int, default=None,
+                        help="Send SIGHUP after this many commands")
+    args = parser.parse_args()
+    with FakeLircd(args.socket, sighup_every=args.sighup_every) as lircd:
+        try:
+            if args.count:
+                lircd.wait_for_clients(1, None)
+                lircd.send_keypresses(args.count, args.rate, args.burst,
+                                      args.repeats)
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
+
+## @}
+#  python_bindings
@@ -0,0 +1,270 @@
+''' In-process keypress broadcast hub. '''
+##
+#   @file hub.py
+#   @brief Read the lircd socket once, publish keypresses to subscribers.
+#   @ingroup  python_bindings
+
+##  @addtogroup python_bindings
+#   @{
+
+##
+#
+#   When several components in one process want the keypress stream, a
+#   KeypressHub reads a single RawConnection and publishes each parsed
+#   Keypress to any number of subscribers. The API is unstable.
+#
+#          hub = lirc.hub.KeypressHub(lirc.client.RawConnection(
+#              socket_path, native=False))
+#          sub = hub.subscribe(remote="Samsung", keys=["KEY_UP"])
+#          hub.start()
+#          while True:
+#              keypress = sub.get()
+#              ... do something with keypress
+#
+#   Each Subscription has a fixed size ring buffer. When it's full the
+#   oldest keypress is dropped and counted in the subscription's overflows
+#   attribute, so a slow subscriber never blocks the hub or others.
+#
+#   The filtering is done in the hub: each keypress is matched using
+#   dict lookups on remote and key, not by calling each subscriber.
+#
+#   Asyncio consumers use subscribe_async(), which returns a subscription
+#   with an async get() and async iteration. It's woken up using
+#   loop.call_soon_threadsafe(), so the hub can run in a thread.
+#
+#   Instead of start(), which runs the hub in a thread, applications
+#   with their own select() loop can call pump() when the connection's
+#   fileno() is readable.
+
+import asyncio
+import collections
+import threading
+
+import lirc.client
+
+
+class Subscription(object):
+    '''
+    A thread subscriber's view of the keypress stream. Attributes:
+      - overflows: Number of keypresses dropped due to a full buffer.
+      - remote, keys: The filter, see KeypressHub.subscribe().
+    '''
+
+    def __init__(self, hub, size, remote, keys):
+        self.overflows = 0
+        self.remote = remote
+        self.keys = keys
+        self._hub = hub
+        self._buffer = collections.deque(maxlen=size)
+        self._cond = threading.Condition()
+
+    def put(self, keypress):
+        ''' Add a keypress, dropping oldest if full. Used by hub. '''
+        with self._cond:
+            if len(self._buffer) == self._buffer.maxlen:
+                self.overflows += 1
+            self._buffer.append(keypress)
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        '''
+        Return next keypress, waiting at most timeout seconds (None:
+        forever). Returns None on timeout.
+        '''
+        with self._cond:
+            if not self._buffer and not self._cond.wait_for(
+                    lambda: self._buffer, timeout):
+                return None
+            return self._buffer.popleft()
+
+    def get_all(self):
+        ''' Return and remove all buffered keypresses, without waiting. '''
+        with self._cond:
+            keypresses = list(self._buffer)
+            self._buffer.clear()
+        return keypresses
+
+    def has_data(self):
+        ''' Check if at least one keypress is available. '''
+        return len(self._buffer) > 0
+
+    def close(self):
+        ''' Unsubscribe from the hub. '''
+        self._hub.unsubscribe(self)
+
+
+class AsyncSubscription(Subscription):
+    ''' An asyncio subscriber's view of the keypress stream. '''
+
+    def __init__(self, hub, size, remote, keys, loop):
+        Subscription.__init__(self, hub, size, remote, keys)
+        self._loop = loop
+        self._waiter = None
+
+    def put(self, keypress):
+        ''' Add a keypress, wake up a waiting get(). Used by hub. '''
+        with self._cond:
+            if len(self._buffer) == self._buffer.maxlen:
+                self.overflows += 1
+            self._buffer.append(keypress)
+            waiter = self._waiter
+            self._waiter = None
+        if waiter:
+            self._loop.call_soon_threadsafe(self._wakeup, waiter)
+
+    @staticmethod
+    def _wakeup(waiter):
+        ''' Resolve waiter in the event loop thread. '''
+        if not waiter.done():
+            waiter.set_result(None)
+
+    async def get(self, timeout=None):
+        '''
+        Return next keypress, waiting at most timeout seconds (None:
+        forever). Returns None on timeout.
+        '''
+        while True:
+            with self._cond:
+                if self._buffer:
+                    return self._buffer.popleft()
+                self._waiter = self._loop.create_future()
+                waiter = self._waiter
+            try:
+                await asyncio.wait_for(waiter, timeout)
+            except asyncio.TimeoutError:
+                return None
+
+    def __aiter__(self):
+        ''' Return async iterator. '''
+        return self
+
+    async def __anext__(self):
+        ''' Implement async iterator.next(). '''
+        return await self.get()
+
+
+class KeypressHub(object):
+    '''
+    Reads keypresses from a lirc.client.RawConnection and publishes them
+    to subscribers. Parameters:
+      - connection: The RawConnection to read from.
+
+    Attributes:
+      - bad_lines: Number of unparsable code strings discarded.
+      - error: The OSError which stopped the reading thread, or None.
+    '''
+
+    def __init__(self, connection):
+        self.bad_lines = 0
+        self.error = None
+        self._conn = connection
+        self._lock = threading.Lock()
+        self._routes = {}
+        self._all = []
+        self._thread = None
+        self._running = False
+
+    def _add(self, sub):
+        ''' Add subscription to the routing tables. '''
+        with self._lock:
+            if sub.remote is None and sub.keys is None:
+                self._all = self._all + [sub]
+                return
+            keys = sub.keys if sub.keys is not None else [None]
+            routes = dict(self._routes)
+            for key in keys:
+                route = (sub.remote, key)
+                routes[route] = routes.get(route, []) + [sub]
+            self._routes = routes
+
+    def subscribe(self, size=256, remote=None, keys=None):
+        '''
+        Return a new Subscription. Parameters:
+          - size: Ring buffer size.
+          - remote: If not None, only keypresses from this remote.
+          - keys: If not None, only keypresses for these keys.
+        '''
+        sub = Subscription(self, size, remote, keys)
+        self._add(sub)
+        return sub
+
+    def subscribe_async(self, size=256, remote=None, keys=None, loop=None):
+        '''
+        Return a new AsyncSubscription bound to loop, by default the
+        running loop. Other parameters as for subscribe().
+        '''
+        loop = loop or asyncio.get_running_loop()
+        sub = AsyncSubscription(self, size, remote, keys, loop)
+        self._add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        ''' Remove a subscription. '''
+        with self._lock:
+            self._all = [s for s in self._all if s is not sub]
+            routes = {}
+            for route, subs in self._routes.items():
+                subs = [s for s in subs if s is not sub]
+                if subs:
+                    routes[route] = subs
+            self._routes = routes
+
+    def publish(self, keypress):
+        ''' Publish a keypress to all matching subscribers. '''
+        routes = self._routes
+        for sub in self._all:
+            sub.put(keypress)
+        if not routes:
+            return
+        remote = keypress.remote
+        key = keypress.key
+        for route in ((remote, key), (remote, None), (None, key)):
+            for sub in routes.get(route, ()):
+                sub.put(keypress)
+
+    def pump(self, timeout=0):
+        '''
+        Read and publish all available keypresses. timeout as for
+        lirc.client.RawConnection.readline(). Returns number of
+        keypresses published.
+        '''
+        count = 0
+        for line in self._conn.readlines(timeout=timeout):
+            try:
+                keypress = lirc.client.parse_keypress(line)
+            except lirc.client.BadPacketException:
+                self.bad_lines += 1
+                continue
+            self.publish(keypress)
+            count += 1
+        return count
+
+    def _run(self):
+        ''' Thread body: pump until stopped or connection fails. '''
+        while self._running:
+            try:
+                self.pump(0.2)
+            except OSError as ex:
+                self.error = ex
+                self._running = False
+
+    def start(self):
+        ''' Start reading in a daemon thread. '''
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        ''' Stop the reading thread, if running. '''
+        self._running = False
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        ''' Stop and close the connection. '''
+        self.stop()
+        self._conn.close()
+
+## @}
+#  python_bindings
@@ -0,0 +1,377 @@
+''' Pure python lircrc parser and translator. '''
+##
+#   @file lircrc.py
+#   @brief Python lircrc compiler, an alternative to lirc_code2char().
+#   @ingroup  python_bindings
+
+##  @addtogroup python_bindings
+#   @{
+
+##
+#
+#   This module provides a pure python implementation of the lircrc
+#   translation done by lirc_readconfig() and lirc_code2char() in
+#   lirc_client. The API is unstable.
+#
+#
+#   Translating keypresses
+#   ----------------------
+#
+#   The lircrc file is compiled into a dispatch table keyed by remote,
+#   button and mode, and translation is a dictionary lookup:
+#
+#          import lirc.client
+#          import lirc.lircrc
+#
+#          lircrc = lirc.lircrc.Lircrc(lircrc_path, program)
+#          conn = lirc.client.RawConnection(socket_path, native=False)
+#          while True:
+#              for string in lircrc.translate(conn.readline()):
+#                  ... do something with string
+#
+#   A Lircrc can also be handed to LircdConnection using its lircrc
+#   argument, replacing the C library translation.
+#
+#
+#   Supported syntax
+#   ----------------
+#
+#   The begin/end blocks, begin <mode>/end <mode> mode blocks and include
+#   directives are supported. Entries support prog, remote, button,
+#   repeat, delay, config (possibly several, cycled), mode and the flags
+#   once, quit, mode, startup_mode and toggle_reset. See lircrc(5).
+#
+#   Like lirc_client, the initial mode is the mode = value of the first
+#   entry with the startup_mode flag; this entry then doesn't change mode
+#   when run. Without such an entry, the program name is used as initial
+#   mode if there is a mode block with this name.
+#
+#   Entries for other programs than the one given are discarded when
+#   compiling. Button sequences (more than one button in an entry) are
+#   not supported.
+#
+#
+#   Reloading
+#   ---------
+#
+#   reload() compiles the file(s) and replaces the dispatch table in a
+#   single assignment, so translation in other threads always sees either
+#   the old or the new table. reload_if_changed() does this only if any
+#   of the files has changed. Using the reload_interval argument, this
+#   check is made automatically by translate().
+
+import os
+import os.path
+import time
+
+import lirc.client
+
+_WILDCARD = "*"
+_FLAGS = ("once", "quit", "mode", "startup_mode", "toggle_reset")
+
+
+class LircrcError(Exception):
+    ''' Malformed or otherwise unparsable lircrc file. '''
+    pass
+
+
+class LircrcEntry(object):
+    ''' A compiled begin/end block in the lircrc file. '''
+    # pylint: disable=too-many-instance-attributes
+
+    __slots__ = ('index', 'prog', 'remote', 'button', 'repeat', 'delay',
+                 'configs', 'mode', 'change_mode', 'flags', 'next_config',
+                 'done')
+
+    def __init__(self, index, mode):
+        self.index = index            ## Position in file(s).
+        self.prog = None              ## Program name.
+        self.remote = _WILDCARD       ## Remote name, lowercase.
+        self.button = _WILDCARD       ## Button name, lowercase.
+        self.repeat = 0               ## Use every n-th repeat, 0 for none.
+        self.delay = 0                ## Repeats to ignore before using them.
+        self.configs = []             ## The strings to return, cycled.
+        self.mode = mode              ## Mode where entry is active or None.
+        self.change_mode = None       ## Mode to enter when executed.
+        self.flags = frozenset()      ## Set of flag names.
+        self.next_config = 0          ## Index of next configs item to use.
+        self.done = False             ## 'once' entry executed in this mode.
+
+    def matches_repeat(self, repeat):
+        ''' Check if given repeat count should trigger this entry. '''
+        if repeat == 0:
+            return True
+        return self.repeat > 0 and repeat > self.delay \
+            and (repeat - self.delay - 1) % self.repeat == 0
+
+
+def _unescape(value):
+    ''' Handle C escape sequences in a config string. '''
+    if "\\" not in value:
+        return value
+    return value.encode("latin-1", "backslashreplace") \
+        .decode("unicode_escape")
+
+
+class _Compiler(object):
+    ''' Parses lircrc file(s) into a list of entries. '''
+
+    def __init__(self, program):
+        self.program = program.lower()
+        self.entries = []
+        self.files = []
+        self.startup_mode = None
+        self._index = 0
+
+    def _error(self, path, lineno, msg):
+        raise LircrcError("%s:%d: %s" % (path, lineno, msg))
+
+    def _set(self, entry, key, value, where):
+        ''' Update entry with a key = value line. '''
+        if key == "prog":
+            entry.prog = value
+        elif key == "remote":
+            entry.remote = value.lower()
+        elif key == "button":
+            if len(value.split()) > 1:
+                self._error(*where, msg="Button sequences not supported")
+            entry.button = value.lower()
+        elif key in ("repeat", "delay"):
+            try:
+                setattr(entry, key, int(value, 0))
+            except ValueError:
+                self._error(*where, msg="Bad %s value: %s" % (key, value))
+        elif key == "config":
+            entry.configs.append(_unescape(value))
+        elif key == "mode":
+            entry.change_mode = value
+        elif key == "flags":
+            flags = set(value.replace("|", " ").split())
+            if not flags.issubset(_FLAGS):
+                self._error(*where, msg="Unknown flags: " + value)
+            entry.flags = entry.flags | flags
+        else:
+            self._error(*where, msg="Unknown keyword: " + key)
+
+    def _add(self, entry, where):
+        ''' Add a completed entry, unless it's for another program. '''
+        if not entry.prog:
+            self._error(*where, msg="Missing prog")
+        if entry.prog.lower() != self.program:
+            return
+        if "startup_mode" in entry.flags and entry.change_mode is not None \
+                and self.startup_mode is None:
+            self.startup_mode = entry.change_mode
+            entry.change_mode = None
+        if entry.change_mode is not None:
+            entry.flags = entry.flags | {"mode"}
+        self.entries.append(entry)
+
+    def compile(self, path, depth=0):
+        ''' Parse given file and its includes. '''
+        # pylint: disable=too-many-branches
+        if depth > 32:
+            raise LircrcError("Too many nested includes: " + path)
+        try:
+            with open(path) as f:
+                lines = f.readlines()
+            st = os.stat(path)
+        except OSError as ex:
+            raise LircrcError("Cannot read %s: %s" % (path, ex))
+        self.files.append((path, st.st_mtime_ns, st.st_size))
+        mode = None
+        entry = None
+        for lineno, line in enumerate(lines, 1):
+            where = (path, lineno)
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            words = line.split(None, 1)
+            if words[0] == "include" and entry is None:
+                incl = words[1].strip() if len(words) > 1 else ""
+                incl = incl.strip('"').lstrip("<").rstrip(">")
+                if not incl:
+                    self._error(*where, msg="Missing include path")
+                incl = os.path.join(os.path.dirname(path),
+                                    os.path.expanduser(incl))
+                self.compile(incl, depth + 1)
+            elif words[0] == "begin" and entry is None:
+                if len(words) > 1:
+                    if mode is not None:
+                        self._error(*where, msg="Nested mode blocks")
+                    mode = words[1].strip()
+                else:
+                    entry = LircrcEntry(self._index, mode)
+                    self._index += 1
+            elif words[0] == "end":
+                if entry is not None and len(words) == 1:
+                    self._add(entry, where)
+                    entry = None
+                elif entry is None and mode is not None:
+                    mode = None
+                else:
+                    self._error(*where, msg="Unexpected end")
+            elif entry is not None and "=" in line:
+                key, value = line.split("=", 1)
+                self._set(entry, key.strip(), value.strip(), where)
+            else:
+                self._error(*where, msg="Cannot parse: " + line)
+        if entry is not None or mode is not None:
+            self._error(path, len(lines), "Missing end")
+
+
+class LircrcTable(object):
+    '''
+    Compiled, immutable lircrc data. Attributes:
+      - entries: List of LircrcEntry in file order.
+      - files: List of (path, mtime_ns, size) for all parsed files.
+      - startup_mode: Initial mode or None.
+      - toggle_reset: List of entries with the toggle_reset flag.
+    '''
+
+    def __init__(self, path, program):
+        compiler = _Compiler(program)
+        compiler.compile(path)
+        self.entries = compiler.entries
+        self.files = compiler.files
+        self.startup_mode = compiler.startup_mode
+        if self.startup_mode is None \
+                and [e for e in self.entries
+                     if e.mode and e.mode.lower() == program.lower()]:
+            self.startup_mode = program
+        self.toggle_reset = \
+            [e for e in self.entries if "toggle_reset" in e.flags]
+        self._by_code = {}
+        for entry in self.entries:
+            key = (entry.remote, entry.button)
+            self._by_code.setdefault(key, []).append(entry)
+        self._dispatch = {}
+
+    def lookup(self, remote, button, mode):
+        '''
+        Return list of entries possibly matching remote, button and mode,
+        in file order. The result is computed once for each argument set.
+        '''
+        key = (remote, button, mode)
+        try:
+            return self._dispatch[key]
+        except KeyError:
+            pass
+        remote = remote.lower()
+        button = button.lower()
+        found = []
+        for code in ((remote, button), (remote, _WILDCARD),
+                     (_WILDCARD, button), (_WILDCARD, _WILDCARD)):
+            found.extend(self._by_code.get(code, []))
+        found = [e for e in found if e.mode is None
+                 or (mode is not None and e.mode.lower() == mode.lower())]
+        found.sort(key=lambda e: e.index)
+        self._dispatch[key] = found
+        return found
+
+
+class Lircrc(object):
+    '''
+    Translates code strings to application strings using a compiled
+    lircrc file. Parameters:
+      - path: lircrc file path, see lirc.client.get_default_lircrc_path()
+      - program: Program name to translate for, see ircat(1).
+      - reload_interval: If not None, translate() checks if any file
+        has changed at most this often (seconds), reloading if so.
+    '''
+
+    def __init__(self, path, program, reload_interval=None):
+        self.path = path
+        self.program = program
+        self._reload_interval = reload_interval
+        self._table = LircrcTable(path, program)
+        self._last_check = time.monotonic()
+        self.mode = self._table.startup_mode
+
+    @property
+    def table(self):
+        ''' The current LircrcTable. '''
+        return self._table
+
+    def reload(self):
+        '''
+        Recompile the file(s) and atomically replace the table. The
+        current mode is kept. On errors LircrcError is raised and the old
+        table is still used.
+        '''
+        self._table = LircrcTable(self.path, self.program)
+        self._last_check = time.monotonic()
+
+    def is_changed(self):
+        ''' Check if any of the files has changed since last load. '''
+        for path, mtime, size in self._table.files:
+            try:
+                st = os.stat(path)
+            except OSError:
+                return True
+            if st.st_mtime_ns != mtime or st.st_size != size:
+                return True
+        return False
+
+    def reload_if_changed(self):
+        ''' Reload if is_changed(), return True if reloaded. '''
+        if not self.is_changed():
+            self._last_check = time.monotonic()
+            return False
+        self.reload()
+        return True
+
+    def _set_mode(self, mode):
+        ''' Enter mode, or leave it if it's the current one. '''
+        if self.mode is not None and mode.lower() == self.mode.lower():
+            mode = None
+        if mode != self.mode:
+            for entry in self._table.entries:
+                entry.done = False
+        self.mode = mode
+
+    def translate(self, code):
+        '''
+        Translate a code string (or a lirc.client.Keypress) to a list of
+        strings, possibly empty.
+        '''
+        if self._reload_interval is not None and \
+                time.monotonic() - self._last_check > self._reload_interval:
+            self.reload_if_changed()
+        if not isinstance(code, lirc.client.Keypress):
+            code = lirc.client.parse_keypress(code)
+        table = self._table
+        entries = table.lookup(code.remote, code.key, self.mode)
+        strings = []
+        executed = set()
+        i = 0
+        while i < len(entries):
+            entry = entries[i]
+            i += 1
+            if not entry.matches_repeat(code.repeat):
+                continue
+            if "once" in entry.flags:
+                if entry.done:
+                    continue
+                entry.done = True
+            executed.add(entry.index)
+            if entry.change_mode is not None:
+                self._set_mode(entry.change_mode)
+                entries = [e for e in table.lookup(code.remote, code.key,
+                                                   self.mode)
+                           if e.index > entry.index]
+                i = 0
+            if entry.configs:
+                strings.append(entry.configs[entry.next_config])
+                entry.next_config = \
+                    (entry.next_config + 1) % len(entry.configs)
+            if "quit" in entry.flags:
+                break
+        if code.repeat == 0:
+            for entry in table.toggle_reset:
+                if entry.index not in executed:
+                    entry.next_config = 0
+        return strings
+
+## @}
+#  python_bindings
@@ -0,0 +1,186 @@
+''' Optional metrics for connections and commands. '''
+##
+#   @file metrics.py
+#   @brief Counters, gauges and latency histograms with export hooks.
+#   @ingroup  python_bindings
+
+##  @addtogroup python_bindings
+#   @{
+
+##
+#
+#   The connections have a metrics attribute, None by default. Setting it
+#   to a Metrics instance makes the connection record what it does. The
+#   API is unstable.
+#
+#          metrics = lirc.metrics.Metrics()
+#          metrics.add_hook(lambda name, value: statsd.gauge(name, value))
+#          conn = lirc.client.CommandConnection(socket_path, native=False)
+#          conn.metrics = metrics
+#          ...
+#          print(metrics.snapshot())
+#
+#   Recorded names, also used when calling the hooks:
+#
+#     - recv_calls, bytes: Socket reads and received bytes
+#       (RawConnection, CommandConnection).
+#     - lines: Code strings or reply lines returned by readline() and
+#       readlines(), or queued by AsyncRawConnection.
+#     - translated: Strings returned by LircdConnection.
+#     - buffered: Gauge, bytes in the receive buffer after a read.
+#     - queue_depth: Gauge, lines queued in AsyncConnection or
+#       AsyncRawConnection after new data is received.
+#     - dropped: Lines dropped by the AsyncRawConnection overflow policy.
+#     - timeouts: Commands failing with TimeoutException.
+#     - latency.<COMMAND>: Histogram of round trip times in seconds for
+#       Command.run(), CommandConnection.run_many() and
+#       AsyncCommandConnection.run(), one for each command word e.g.,
+#       latency.SEND_ONCE.
+#
+#   Counters are called with the increment, gauges and histograms with
+#   the new value. For gauges the max value is kept in high_water.
+#
+#   LircdConnection and AsyncConnection use the metrics of the wrapped
+#   connection, so setting it on either of them covers both layers. A
+#   Metrics can be shared by connections in different threads.
+#   Recording costs one lock round trip per event; connections without
+#   metrics only test the attribute.
+
+import bisect
+import collections
+import threading
+
+## Upper bounds of the latency buckets, seconds.
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+           0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Histogram(object):
+    '''
+    Histogram with fixed buckets. Parameters:
+      - bounds: Sorted upper bounds of the buckets.
+
+    Attributes:
+      - counts: Number of values in each bucket, the last one counting
+        values larger than all bounds.
+      - count, total, max: Number, sum and max of all values.
+    '''
+
+    def __init__(self, bounds=BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        ''' Add a value. '''
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, fraction):
+        '''
+        Return upper bound of the bucket holding the given fraction
+        (0..1) of the values, or max if it's the last bucket.
+        '''
+        rank = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count > 0:
+                return self.bounds[i] if i < len(self.bounds) else self.max
+        return 0.0
+
+    def mean(self):
+        ''' Return the mean value, 0 if empty. '''
+        return self.total / self.count if self.count else 0.0
+
+
+class Metrics(object):
+    '''
+    Collects counters, gauges and histograms. Attributes:
+      - counters: Dict of name -> total.
+      - gauges: Dict of name -> last value.
+      - high_water: Dict of name -> max value for gauges.
+      - histograms: Dict of name -> Histogram.
+    '''
+
+    def __init__(self):
+        self.counters = collections.defaultdict(int)
+        self.gauges = {}
+        self.high_water = collections.defaultdict(int)
+        self.histograms = {}
+        self._hooks = []
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook):
+        ''' Add a hook(name, value) called for each recorded event. '''
+        self._hooks = self._hooks + [hook]
+
+    def remove_hook(self, hook):
+        ''' Remove a hook added using add_hook(). '''
+        self._hooks = [h for h in self._hooks if h is not hook]
+
+    def count(self, name, value=1):
+        ''' Add value to a counter. '''
+        with self._lock:
+            self.counters[name] += value
+        for hook in self._hooks:
+            hook(name, value)
+
+    def gauge(self, name, value):
+        ''' Set a gauge, updating its high water mark. '''
+        with self._lock:
+            self.gauges[name] = value
+            if value > self.high_water[name]:
+                self.high_water[name] = value
+        for hook in self._hooks:
+            hook(name, value)
+
+    def observe(self, name, value):
+        ''' Add a value to a histogram. '''
+        with self._lock:
+            try:
+                self.histograms[name].observe(value)
+            except KeyError:
+                self.histograms[name] = Histogram()
+                self.histograms[name].observe(value)
+        for hook in self._hooks:
+            hook(name, value)
+
+    def snapshot(self):
+        '''
+        Return a dict with copies of counters, gauges and high_water,
+        and a summary (count, mean, p50, p99, max) of each histogram.
+        '''
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "high_water": dict(self.high_water),
+                "histograms": {
+                    name: {"count": h.count, "mean": h.mean(),
+                           "p50": h.percentile(0.5),
+                           "p99": h.percentile(0.99), "max": h.max}
+                    for name, h in self.histograms.items()}
+            }
+
+    def reset(self):
+        ''' Clear all recorded data, keeping the hooks. '''
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.high_water.clear()
+            self.histograms.clear()
+
+
+def command_name(cmd_string):
+    ''' Return the histogram name for a command string. '''
+    words = cmd_string.split(None, 1)
+    return "latency." + (words[0].upper() if words else "")
+
+## @}
+#  python_bindings
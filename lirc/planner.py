@@ -0,0 +1,256 @@
+''' Plan batches of transmit jobs using few SET_TRANSMITTERS. '''
+##
+#   @file planner.py
+#   @brief Group and order send jobs by transmitter mask.
+#   @ingroup  python_bindings
+
+##  @addtogroup python_bindings
+#   @{
+
+##
+#
+#   Sending through different emitters requires a SET_TRANSMITTERS
+#   before each SEND_ONCE when the mask changes. plan() takes a batch of
+#   Job and orders them so the mask changes as rarely as possible, and
+#   Plan.execute() runs the result. The API is unstable.
+#
+#          jobs = [lirc.planner.Job([1], "tv", ["KEY_POWER"]),
+#                  lirc.planner.Job([2], "amp", ["KEY_POWER"]),
+#                  lirc.planner.Job([1], "tv", ["KEY_1"], after=(0,))]
+#          result = lirc.planner.plan(jobs).execute(conn)
+#          print(result.round_trips, result.saved)
+#
+#   Jobs are only reordered where the caller allows it: a job's after
+#   tuple lists the indexes of jobs which must be sent before it. Other
+#   jobs may run in any order. Among the jobs ready to run, those using
+#   the current mask are taken first, preferring the remote used last.
+#   Otherwise the mask which can run most jobs before it must change is
+#   selected, counting jobs which become ready on the way. On a tie, the
+#   mask whose jobs make most jobs using other masks ready wins, so these
+#   can join a later group. Adjacent jobs with the same mask and remote
+#   are merged into one SEND_ONCE.
+#
+#   execute() makes one round trip for each SET_TRANSMITTERS, checking
+#   the reply before sending, and one for all SEND_ONCE commands using
+#   that mask, see CommandConnection.run_many(). Using pipeline=True
+#   the whole plan is written at once in a single round trip; sends
+#   then happen even if a SET_TRANSMITTERS fails.
+#
+#   The baseline is the naive way: a SET_TRANSMITTERS and a SEND_ONCE
+#   round trip for each job. The saved round trips are reported in the
+#   PlanResult.
+
+import collections
+
+import lirc.client
+
+
+class Job(collections.namedtuple(
+        'Job', 'transmitters remote keys after', defaults=((),))):
+    '''
+    A send job:
+      - transmitters: List of transmitter numbers (1-based) or a mask,
+        as for lirc.client.SetTransmittersCommand.
+      - remote, keys: As for lirc.client.SendCommand.
+      - after: Indexes of jobs which must be sent before this one.
+    '''
+    __slots__ = ()
+
+
+PlanResult = collections.namedtuple('PlanResult', 'replies round_trips saved')
+PlanResult.__doc__ = '''
+    Result of Plan.execute():
+      - replies: List of Reply for each job, in job order. A job not
+        sent since its SET_TRANSMITTERS failed has that Reply.
+      - round_trips: Number of round trips made.
+      - saved: Round trips saved compared to the baseline.
+'''
+
+
+def mask_of(transmitters):
+    ''' Return the SET_TRANSMITTERS mask for a list or a mask. '''
+    if not isinstance(transmitters, (list, tuple, set, frozenset)):
+        return int(transmitters)
+    mask = 0
+    for transmitter in transmitters:
+        mask |= 1 << (int(transmitter) - 1)
+    return mask
+
+
+class Plan(object):
+    '''
+    An ordered plan from plan(). Attributes:
+      - jobs: The planned jobs.
+      - current: The transmitter mask assumed to be set initially.
+      - steps: List of (mask, remote, keys, job indexes), one for each
+        SEND_ONCE.
+      - mask_changes: Number of SET_TRANSMITTERS commands.
+      - baseline: Round trips in the naive, one job at a time way.
+    '''
+
+    def __init__(self, jobs, steps, current=None):
+        self.jobs = jobs
+        self.steps = steps
+        self.current = current
+        self.baseline = 2 * len(jobs)
+        self.mask_changes = len([g for g in self._groups() if g[2]])
+
+    def _groups(self):
+        '''
+        Return list of (mask, steps, needs_set) for each run of steps
+        with the same mask.
+        '''
+        groups = []
+        for step in self.steps:
+            if groups and groups[-1][0] == step[0]:
+                groups[-1][1].append(step)
+            else:
+                needs_set = bool(groups) or step[0] != self.current
+                groups.append((step[0], [step], needs_set))
+        return groups
+
+    @staticmethod
+    def _send_string(step):
+        ''' Return SEND_ONCE command string for a step. '''
+        return "SEND_ONCE %s %s\n" % (step[1], " ".join(step[2]))
+
+    def _execute_pipelined(self, connection, timeout):
+        ''' Run all commands in a single write, return PlanResult. '''
+        replies = [None] * len(self.jobs)
+        commands = []
+        for mask, steps, needs_set in self._groups():
+            if needs_set:
+                commands.append("SET_TRANSMITTERS %d\n" % mask)
+            commands.extend([self._send_string(s) for s in steps])
+        results = iter(connection.run_many(commands, timeout))
+        for _, steps, needs_set in self._groups():
+            if needs_set:
+                next(results)
+            for step in steps:
+                reply = next(results)
+                for i in step[3]:
+                    replies[i] = reply
+        return PlanResult(replies, 1, self.baseline - 1)
+
+    def execute(self, connection, pipeline=False, timeout=None):
+        '''
+        Run the plan on a CommandConnection, return a PlanResult.
+        timeout is as for CommandConnection.run_many().
+        '''
+        if not self.steps:
+            return PlanResult([], 0, 0)
+        if pipeline:
+            return self._execute_pipelined(connection, timeout)
+        replies = [None] * len(self.jobs)
+        round_trips = 0
+        for mask, steps, needs_set in self._groups():
+            if needs_set:
+                reply = connection.run_many(
+                    ["SET_TRANSMITTERS %d\n" % mask], timeout)[0]
+                round_trips += 1
+                if not reply.success \
+                        or reply.result != lirc.client.Result.OK:
+                    for step in steps:
+                        for i in step[3]:
+                            replies[i] = reply
+                    continue
+            results = connection.run_many(
+                [self._send_string(s) for s in steps], timeout)
+            round_trips += 1
+            for step, reply in zip(steps, results):
+                for i in step[3]:
+                    replies[i] = reply
+        return PlanResult(replies, round_trips, self.baseline - round_trips)
+
+
+def _dependencies(jobs):
+    '''
+    Return list of the number of jobs each job waits for, and a dict
+    of job index -> indexes of jobs waiting for it.
+    '''
+    waiting = [0] * len(jobs)
+    dependents = collections.defaultdict(list)
+    for i, job in enumerate(jobs):
+        for before in set(job.after):
+            if not 0 <= before < len(jobs) or before == i:
+                raise ValueError("Bad after index %s in job %d" % (before, i))
+            waiting[i] += 1
+            dependents[before].append(i)
+    return waiting, dependents
+
+
+def _score(mask, ready, masks, waiting, dependents):
+    '''
+    Return (jobs run, jobs using other masks made ready) if jobs using
+    mask are run until none is ready.
+    '''
+    left = {}
+    todo = [i for i in ready if masks[i] == mask]
+    run = 0
+    unblocked = 0
+    while todo:
+        run += 1
+        for dependent in dependents[todo.pop()]:
+            left[dependent] = left.get(dependent, waiting[dependent]) - 1
+            if left[dependent] > 0:
+                continue
+            if masks[dependent] == mask:
+                todo.append(dependent)
+            else:
+                unblocked += 1
+    return run, unblocked
+
+
+def _order(jobs, masks, current):
+    ''' Return job indexes in planned order, see module docs. '''
+    waiting, dependents = _dependencies(jobs)
+    ready = [i for i in range(len(jobs)) if waiting[i] == 0]
+    order = []
+    mask = current
+    remote = None
+    while ready:
+        same = [i for i in ready if masks[i] == mask]
+        if not same:
+            scores = {m: _score(m, ready, masks, waiting, dependents)
+                      for m in set([masks[i] for i in ready])}
+            mask = max(scores, key=lambda m: (scores[m], -min(
+                [i for i in ready if masks[i] == m])))
+            continue
+        same_remote = [i for i in same if jobs[i].remote == remote]
+        i = min(same_remote or same)
+        remote = jobs[i].remote
+        ready.remove(i)
+        order.append(i)
+        for dependent in dependents[i]:
+            waiting[dependent] -= 1
+            if waiting[dependent] == 0:
+                ready.append(dependent)
+    if len(order) < len(jobs):
+        raise ValueError("Cyclic ordering constraints in jobs.")
+    return order
+
+
+def plan(jobs, current=None, max_keys=16):
+    '''
+    Return a Plan for a list of Job. Parameters:
+      - current: The current transmitter mask if known, else None.
+      - max_keys: Max number of keys in a merged SEND_ONCE.
+
+    Raises ValueError on bad or cyclic ordering constraints.
+    '''
+    jobs = list(jobs)
+    masks = [mask_of(job.transmitters) for job in jobs]
+    steps = []
+    for i in _order(jobs, masks, current):
+        job = jobs[i]
+        last = steps[-1] if steps else None
+        if last and last[0] == masks[i] and last[1] == job.remote \
+                and len(last[2]) + len(job.keys) <= max_keys:
+            last[2].extend(job.keys)
+            last[3].append(i)
+        else:
+            steps.append((masks[i], job.remote, list(job.keys), [i]))
+    return Plan(jobs, steps, current)
+
+## @}
+#  python_bindings
@@ -0,0 +1,232 @@
+''' Thread-safe pool of lircd command connections. '''
+##
+#   @file pool.py
+#   @brief A pool of CommandConnection shared by threads.
+#   @ingroup  python_bindings
+
+##  @addtogroup python_bindings
+#   @{
+
+##
+#
+#   A CommandConnection cannot be shared between threads, and creating a
+#   new one for each command is expensive. The CommandConnectionPool
+#   keeps a bounded set of connections which are checked out by one
+#   thread at a time. The API is unstable.
+#
+#          pool = lirc.pool.CommandConnectionPool(maxsize=4)
+#          reply = pool.run(lirc.client.ListKeysCommand, remote)
+#
+#   or, using a connection for more than one command:
+#
+#          with pool.connection() as conn:
+#              lirc.client.SetTransmittersCommand(conn, [1]).run()
+#              lirc.client.SendCommand(conn, remote, keys).run()
+#
+#   Connections which have been idle longer than check_interval are
+#   verified using a VERSION command before being handed out. run()
+#   retries once on a new connection if the connection is broken, e.g.
+#   after a lircd restart. Commands which may have reached lircd before
+#   the failure are only retried if they are read-only (LIST, VERSION),
+#   so e.g. a SEND_ONCE KEY_POWER is never transmitted twice.
+#
+#   The pool uses native=False connections by default, since the socket
+#   opened by lirc_init() is a global shared by all such connections.
+
+import collections
+import threading
+import time
+
+import lirc.client
+
+_READ_ONLY = ("LIST", "VERSION")
+
+
+class PoolTimeoutException(lirc.client.TimeoutException):
+    ''' No connection available in the pool within timeout. '''
+    pass
+
+
+class CommandConnectionPool(object):
+    '''
+    A bounded, thread-safe pool of CommandConnection. Parameters:
+      - socket_path: lircd socket path or tcp:// address, see
+        lirc.client.get_default_socket_path() for defaults. The default
+        is looked up once when creating the pool.
+      - maxsize: Max number of open connections.
+      - timeout: Seconds to wait in checkout() when all connections are
+        in use (None: wait forever), also used as the read timeout in
+        run().
+      - check_interval: Idle connections unused for more than this many
+        seconds are checked using VersionCommand before use. None
+        disables the checks.
+      - native: Passed to CommandConnection.
+    '''
+    # pylint: disable=too-many-arguments
+
+    def __init__(self, socket_path=None, maxsize=4, timeout=None,
+                 check_interval=30, native=False):
+        self.socket_path = \
+            socket_path or lirc.client.get_default_socket_path()
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self._native = native
+        self._idle = collections.deque()
+        self._size = 0
+        self._closed = False
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+
+    def _connect(self):
+        ''' Open a new connection, fix size on errors. '''
+        try:
+            return lirc.client.CommandConnection(self.socket_path,
+                                                 native=self._native)
+        except Exception:
+            with self._lock:
+                self._size -= 1
+                self._available.notify()
+            raise
+
+    def _is_healthy(self, conn):
+        ''' Check connection using a VERSION command. '''
+        try:
+            reply = lirc.client.VersionCommand(conn).run(
+                self.timeout if self.timeout else 1.0)
+        except (OSError, lirc.client.TimeoutException,
+                lirc.client.BadPacketException):
+            return False
+        return bool(reply.success)
+
+    def checkout(self):
+        '''
+        Return a connection for exclusive use until checkin(). Raises
+        PoolTimeoutException if none is available within timeout.
+        '''
+        deadline = None
+        if self.timeout is not None:
+            deadline = time.monotonic() + self.timeout
+        with self._lock:
+            while self._closed or \
+                    (not self._idle and self._size >= self.maxsize):
+                if self._closed:
+                    raise ValueError("Pool is closed.")
+                to = None
+                if deadline is not None:
+                    to = deadline - time.monotonic()
+                    if to <= 0:
+                        raise PoolTimeoutException(
+                            "No free lircd connection in pool.")
+                self._available.wait(to)
+            if self._idle:
+                conn, last_used = self._idle.pop()
+            else:
+                self._size += 1
+                conn = None
+        if conn is None:
+            return self._connect()
+        if self.check_interval is not None \
+                and time.monotonic() - last_used > self.check_interval \
+                and not self._is_healthy(conn):
+            conn.close()
+            return self._connect()
+        return conn
+
+    def checkin(self, conn, broken=False):
+        '''
+        Return a connection to the pool. Broken connections are closed
+        instead of being reused.
+        '''
+        with self._lock:
+            if broken or self._closed:
+                self._size -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._available.notify()
+        if broken or self._closed:
+            conn.close()
+
+    def connection(self):
+        '''
+        Return a context manager handling checkout() and checkin(). The
+        connection is discarded if the block raises an exception.
+        '''
+        return _PooledConnection(self)
+
+    def discard_idle(self):
+        ''' Close all idle connections, e.g. after a lircd restart. '''
+        with self._lock:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._available.notify_all()
+        for conn, _ in idle:
+            conn.close()
+
+    def run(self, command_class, *args):
+        '''
+        Create a command_class(conn, *args) using a pooled connection, run
+        it and return the Reply. If the connection is broken, idle
+        connections are discarded and the command is retried once on a
+        new connection, provided it was not sent or is read-only.
+        '''
+        for attempt in range(2):
+            conn = self.checkout()
+            guard = _SendGuard(conn)
+            try:
+                command = command_class(guard, *args)
+                reply = command.run(self.timeout)
+            except OSError:
+                self.checkin(conn, broken=True)
+                if attempt > 0 or guard.sent \
+                        and command.cmd_string.split()[0] not in _READ_ONLY:
+                    raise
+                self.discard_idle()
+                continue
+            except Exception:
+                self.checkin(conn, broken=True)
+                raise
+            self.checkin(conn)
+            return reply
+
+    def close(self):
+        ''' Close all idle connections; others are closed on checkin. '''
+        with self._lock:
+            self._closed = True
+        self.discard_idle()
+
+
+class _SendGuard(object):
+    ''' Wraps a connection, recording if send() has succeeded. '''
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, conn):
+        self.sent = False
+        self._conn = conn
+
+    def send(self, command):
+        ''' Send command using the connection. '''
+        self._conn.send(command)
+        self.sent = True
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class _PooledConnection(object):
+    ''' Context manager for CommandConnectionPool.connection(). '''
+
+    def __init__(self, pool):
+        self._pool = pool
+        self._conn = None
+
+    def __enter__(self):
+        self._conn = self._pool.checkout()
+        return self._conn
+
+    def __exit__(self, exc_type, exc, traceback):
+        self._pool.checkin(self._conn, broken=exc_type is not None)
+
+## @}
+#  python_bindings
@@ -0,0 +1,191 @@
+''' Sans-IO parser for the lircd socket protocol. '''
+##
+#   @file protocol.py
+#   @brief IO-free parser for lircd replies and keypresses.
+#   @ingroup  python_bindings
+
+##  @addtogroup python_bindings
+#   @{
+
+##
+#
+#   This module provides a parser for the data stream from a lircd socket
+#   which does no IO by itself. It accepts arbitrary byte chunks and
+#   returns a list of events, which are either command replies or
+#   keypresses. The API is unstable.
+#
+#          protocol = lirc.protocol.LircdProtocol()
+#          while True:
+#              for event in protocol.feed(sock.recv(4096)):
+#                  if isinstance(event, lirc.client.Reply):
+#                      ... handle a command reply, or a SIGHUP packet
+#                      ... if event.sighup is True.
+#                  else:
+#                      ... handle a keypress code string.
+#
+#   A reply which cannot be parsed is returned with result set to
+#   lirc.client.Result.FAIL. The rest of the broken packet is discarded
+#   up to its END, or up to a BEGIN, after which parsing continues with
+#   next packet. This keeps replies aligned with the commands when
+#   pipelining.
+#
+#   The same parser is used by lirc.async_client.AsyncCommandConnection.
+
+import lirc.client
+
+_OUTSIDE = 0
+_COMMAND = 1
+_RESULT = 2
+_DATA = 3
+_LINE_COUNT = 4
+_LINES = 5
+_END = 6
+_SIGHUP_END = 7
+_RESYNC = 8
+
+
+class StreamReply(lirc.client.Reply):
+    '''
+    A Reply produced by LircdProtocol. In addition to the Reply
+    attributes it has:
+       - command: string, the command line echoed by lircd.
+    '''
+
+    def __init__(self):
+        lirc.client.Reply.__init__(self)
+        self.command = ""
+
+
+class LircdProtocol(object):
+    '''
+    Parses data from a lircd socket into replies and keypresses.
+    Parameters:
+      - parse_keypresses: If True, keypresses are returned as
+        lirc.client.Keypress, otherwise as code strings. Unparsable code
+        strings are then discarded and counted in bad_lines.
+
+    The attribute sighups counts received SIGHUP packets.
+    '''
+
+    def __init__(self, parse_keypresses=False):
+        self.sighups = 0
+        self.bad_lines = 0
+        self._parse_keypresses = parse_keypresses
+        self._buffer = bytearray(0)
+        self._state = _OUTSIDE
+        self._reply = None
+        self._lines_expected = 0
+
+    def feed(self, data):
+        '''
+        Enter a chunk of bytes, return list of events completed so far.
+        Incomplete lines are kept until next call.
+        '''
+        self._buffer += data
+        end = self._buffer.rfind(b'\n')
+        if end < 0:
+            return []
+        text = self._buffer[:end].decode("ascii", "ignore")
+        del self._buffer[:end + 1]
+        return self.feed_lines(text.split("\n"))
+
+    def _keypress(self, line, events):
+        ''' Add keypress event for line. '''
+        if not self._parse_keypresses:
+            events.append(line)
+            return
+        try:
+            events.append(lirc.client.parse_keypress(line))
+        except lirc.client.BadPacketException:
+            self.bad_lines += 1
+
+    def _complete(self, events, success=None):
+        '''
+        Add current reply to events, possibly as failed. After a failure
+        the rest of the packet is skipped.
+        '''
+        reply = self._reply
+        if success is False:
+            reply.result = lirc.client.Result.FAIL
+            reply.success = False
+            self._state = _RESYNC
+        else:
+            reply.result = lirc.client.Result.OK
+            self._state = _OUTSIDE
+        events.append(reply)
+        self._reply = None
+
+    def feed_lines(self, lines):
+        ''' Enter a list of lines without newlines, return events. '''
+        # pylint: disable=too-many-branches
+        events = []
+        for line in lines:
+            state = self._state
+            if state == _OUTSIDE:
+                if line == "BEGIN":
+                    self._reply = StreamReply()
+                    self._state = _COMMAND
+                elif line:
+                    self._keypress(line, events)
+                continue
+            line = line.strip()
+            if not line:
+                continue
+            if state == _RESYNC:
+                if line == "END":
+                    self._state = _OUTSIDE
+                elif line == "BEGIN":
+                    self._reply = StreamReply()
+                    self._state = _COMMAND
+                continue
+            reply = self._reply
+            reply.last_line = line
+            if state == _LINES:
+                reply.data.append(line)
+                if len(reply.data) >= self._lines_expected:
+                    self._state = _END
+            elif state == _COMMAND:
+                if line == "SIGHUP":
+                    reply.sighup = True
+                    self._state = _SIGHUP_END
+                else:
+                    reply.command = line
+                    self._state = _RESULT
+            elif state == _RESULT:
+                if line == "SUCCESS" or line == "ERROR":
+                    reply.success = line == "SUCCESS"
+                    self._state = _DATA
+                else:
+                    self._complete(events, False)
+            elif state == _DATA:
+                if line == "END":
+                    self._complete(events)
+                elif line == "DATA":
+                    self._state = _LINE_COUNT
+                else:
+                    self._complete(events, False)
+            elif state == _LINE_COUNT:
+                try:
+                    self._lines_expected = int(line)
+                except ValueError:
+                    self._complete(events, False)
+                else:
+                    self._state = \
+                        _LINES if self._lines_expected > 0 else _END
+            elif line == "END":
+                if state == _SIGHUP_END:
+                    self.sighups += 1
+                    lirc.client.note_sighup()
+                self._complete(events)
+            else:
+                self._complete(events, False)
+            if self._state == _RESYNC:
+                if line == "BEGIN":
+                    self._reply = StreamReply()
+                    self._state = _COMMAND
+                elif line == "END":
+                    self._state = _OUTSIDE
+        return events
+
+## @}
+#  python_bindings
@@ -0,0 +1,254 @@
+''' Single-thread reactor for many lircd connections. '''
+##
+#   @file reactor.py
+#   @brief selectors based event loop for connections, commands and timers.
+#   @ingroup  python_bindings
+
+##  @addtogroup python_bindings
+#   @{
+
+##
+#
+#   The Reactor multiplexes any number of RawConnection, LircdConnection
+#   and CommandConnection in one thread, e.g. one for each lircd instance
+#   on a host, without asyncio. The API is unstable.
+#
+#          reactor = lirc.reactor.Reactor()
+#          for path in socket_paths:
+#              conn = lirc.client.RawConnection(path, native=False)
+#              reactor.add(conn, lambda lines, p=path: handle(p, lines))
+#          cmd = lirc.client.CommandConnection(tx_path, native=False)
+#          reactor.add(cmd)
+#          reactor.send(cmd, lirc.client.VersionCommand(cmd), print, 1.0)
+#          reactor.call_later(60, check_something)
+#          reactor.run()
+#
+#   Each source has a callback called with the list of received lines.
+#   Replies to commands issued using send() are parsed using a
+#   lirc.protocol.LircdProtocol and handed to the send() callback in
+#   FIFO order, so several commands can be in flight on one connection.
+#   SIGHUP packets are counted in sighups and not passed on.
+#
+#   Draining is fair: each round reads at most max_lines lines from each
+#   ready RawConnection. Sources with more buffered lines are served
+#   again in the next round, after the others, without waiting.
+#
+#   Timers are kept in a heap and run from the reactor thread, using
+#   time.monotonic(). Periodic jobs re-schedule themselves.
+#
+#   When a source fails or is closed by lircd it's removed, its
+#   on_close callback is called with the exception, and pending send()
+#   callbacks get None.
+
+import collections
+import heapq
+import itertools
+import selectors
+import time
+
+import lirc.client
+import lirc.protocol
+
+
+class Timer(object):
+    ''' A call scheduled by Reactor.call_later(). '''
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.cancelled = False
+        self._callback = callback
+        self._args = args
+
+    def cancel(self):
+        ''' Don't run the timer. '''
+        self.cancelled = True
+
+    def run(self):
+        ''' Run the callback. '''
+        self._callback(*self._args)
+
+
+class _Source(object):
+    ''' A connection managed by the reactor. '''
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, connection, callback, on_close):
+        self.connection = connection
+        self.fd = connection.fileno()
+        self.callback = callback
+        self.on_close = on_close
+        self.protocol = lirc.protocol.LircdProtocol()
+        self.pending = collections.deque()
+
+
+class Reactor(object):
+    '''
+    Runs callbacks for many connections and timers in one thread.
+    Parameters:
+      - max_lines: Max lines read from a source in each round.
+
+    The sighups attribute counts SIGHUP packets from all sources.
+    '''
+
+    def __init__(self, max_lines=64):
+        self.max_lines = max_lines
+        self.sighups = 0
+        self._select = selectors.DefaultSelector()
+        self._sources = {}
+        self._backlog = []
+        self._timers = []
+        self._seq = itertools.count()
+        self._running = False
+
+    def add(self, connection, callback=None, on_close=None):
+        '''
+        Add a connection. Parameters:
+          - connection: A RawConnection, CommandConnection,
+            LircdConnection or other object with fileno() and readlines().
+          - callback: Called with list of received lines, except command
+            replies. None discards them.
+          - on_close: Called with the exception when the source fails.
+        '''
+        source = _Source(connection, callback, on_close)
+        self._sources[connection] = source
+        self._select.register(source.fd, selectors.EVENT_READ, source)
+
+    def remove(self, connection):
+        ''' Remove a connection, without closing it. '''
+        source = self._sources.pop(connection, None)
+        if source is None:
+            return
+        self._select.unregister(source.fd)
+        if source in self._backlog:
+            self._backlog.remove(source)
+        while source.pending:
+            entry = source.pending.popleft()
+            if entry[1] is not None:
+                entry[1].cancel()
+            if entry[0]:
+                entry[0](None)
+
+    def send(self, connection, command, callback=None, timeout=None):
+        '''
+        Send a lirc.client.Command or command string on an added
+        CommandConnection. callback is called with the Reply, or with
+        None if no reply is received within timeout seconds.
+        '''
+        source = self._sources[connection]
+        if isinstance(command, lirc.client.Command):
+            command = command.cmd_string
+        entry = [callback, None]
+        if timeout is not None:
+            entry[1] = self.call_later(timeout, self._expire, entry)
+        source.pending.append(entry)
+        connection.send(command)
+
+    @staticmethod
+    def _expire(entry):
+        ''' Report a command timeout; the late reply is discarded. '''
+        callback = entry[0]
+        entry[0] = None
+        if callback:
+            callback(None)
+
+    def call_later(self, delay, callback, *args):
+        ''' Run callback(*args) after delay seconds, return a Timer. '''
+        timer = Timer(time.monotonic() + delay, callback, args)
+        heapq.heappush(self._timers, (timer.when, next(self._seq), timer))
+        return timer
+
+    def _run_timers(self):
+        ''' Run expired timers, return seconds until next one or None. '''
+        while self._timers:
+            when, _, timer = self._timers[0]
+            if timer.cancelled:
+                heapq.heappop(self._timers)
+                continue
+            delay = when - time.monotonic()
+            if delay > 0:
+                return delay
+            heapq.heappop(self._timers)
+            timer.run()
+        return None
+
+    def _read(self, source):
+        ''' Read lines from source, return them or None if it failed. '''
+        conn = source.connection
+        try:
+            if isinstance(conn, lirc.client.RawConnection):
+                return conn.readlines(self.max_lines, timeout=0)
+            return conn.readlines(timeout=0)
+        except OSError as ex:
+            self.remove(conn)
+            if source.on_close:
+                source.on_close(ex)
+            return None
+
+    def _drain(self, source):
+        ''' Read from a ready source and run callbacks. '''
+        lines = self._read(source)
+        if not lines:
+            return
+        sighups = source.protocol.sighups
+        events = source.protocol.feed_lines(lines)
+        self.sighups += source.protocol.sighups - sighups
+        lines = []
+        for event in events:
+            if not isinstance(event, lirc.client.Reply):
+                lines.append(event)
+            elif not event.sighup and source.pending:
+                callback, timer = source.pending.popleft()
+                if timer is not None:
+                    timer.cancel()
+                if callback:
+                    callback(event)
+        if lines and source.callback:
+            source.callback(lines)
+        if source.connection in self._sources \
+                and source.connection.has_data():
+            self._backlog.append(source)
+
+    def run_once(self, timeout=None):
+        '''
+        Wait at most timeout seconds (None: until something happens),
+        then serve ready sources and expired timers once.
+        '''
+        delay = self._run_timers()
+        if self._backlog:
+            timeout = 0
+        elif delay is not None:
+            timeout = delay if timeout is None else min(timeout, delay)
+        ready = [key.data for key, _ in self._select.select(timeout)]
+        sources = self._backlog
+        self._backlog = []
+        for source in ready:
+            if source not in sources:
+                sources.append(source)
+        for source in sources:
+            if source.connection in self._sources:
+                self._drain(source)
+        self._run_timers()
+
+    def run(self):
+        ''' Run until stop() is called. '''
+        self._running = True
+        while self._running:
+            self.run_once()
+
+    def stop(self):
+        '''
+        Make run() return after the current round. Call it from the
+        reactor thread, i.e. from a callback or timer.
+        '''
+        self._running = False
+
+    def close(self):
+        ''' Remove and close all connections. '''
+        for conn in list(self._sources):
+            self.remove(conn)
+            conn.close()
+        self._select.close()
+
+## @}
+#  python_bindings
@@ -0,0 +1,215 @@
+''' Thread-safe, rate limited queue for transmit commands. '''
+##
+#   @file scheduler.py
+#   @brief Serialize, coalesce and pace SEND_* commands from many threads.
+#   @ingroup  python_bindings
+
+##  @addtogroup python_bindings
+#   @{
+
+##
+#
+#   A SendScheduler owns a CommandConnection and a thread which runs all
+#   transmit requests, one command at a time. Any thread can queue
+#   requests; each returns a concurrent.futures.Future holding the
+#   Reply. The API is unstable.
+#
+#          scheduler = lirc.scheduler.SendScheduler(
+#              lirc.client.CommandConnection(socket_path, native=False),
+#              gap=0.05)
+#          scheduler.send_once("Samsung", ["KEY_1", "KEY_2"])
+#          reply = scheduler.send_once("Samsung", ["KEY_OK"]).result()
+#
+#   Requests run in the order queued. SEND_ONCE requests for the same
+#   remote which are next to each other in the queue are merged into a
+#   single SEND_ONCE with all keys (at most max_keys), since lircd
+#   accepts a list of keys. All merged requests get the same Reply, so
+#   an unknown key makes the merged requests fail together. Cancelled
+#   futures are dropped from the queue without sending anything.
+#
+#   After each command the scheduler waits until gap seconds have
+#   passed before the next one is written, so bursts from many threads
+#   cannot overrun the transmitter. Requests queued during the gap are
+#   merged as above.
+#
+#   The queue depth is available as depth, its max in high_water. The
+#   time each request spent queued is recorded in the waits histogram,
+#   see lirc.metrics.Histogram. If the metrics attribute is set to a
+#   lirc.metrics.Metrics, also the send_queue_depth gauge and the
+#   send_wait histogram are recorded there.
+
+import collections
+import concurrent.futures
+import threading
+import time
+
+import lirc.client
+import lirc.metrics
+
+
+class _Request(object):
+    ''' A queued command. '''
+    # pylint: disable=too-few-public-methods
+
+    __slots__ = ('command', 'remote', 'keys', 'future', 'queued')
+
+    def __init__(self, command, remote=None, keys=None):
+        self.command = command
+        self.remote = remote
+        self.keys = keys
+        self.future = concurrent.futures.Future()
+        self.queued = time.monotonic()
+
+
+class SendScheduler(object):
+    '''
+    Runs transmit commands from a queue in a thread. Parameters:
+      - connection: The CommandConnection to use, owned by the scheduler
+        and closed by close().
+      - gap: Min seconds from the end of a command to the next one.
+      - max_keys: Max number of keys in a merged SEND_ONCE.
+      - timeout: Read timeout for each command, see Command.run().
+
+    Attributes:
+      - high_water: Max queue depth seen.
+      - commands: Number of commands sent to lircd.
+      - coalesced: Number of requests merged into an earlier one.
+      - waits: lirc.metrics.Histogram of seconds spent queued.
+      - metrics: None or a lirc.metrics.Metrics, see module docs.
+    '''
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, connection, gap=0.0, max_keys=16, timeout=None):
+        self.gap = gap
+        self.max_keys = max_keys
+        self.timeout = timeout
+        self.high_water = 0
+        self.commands = 0
+        self.coalesced = 0
+        self.waits = lirc.metrics.Histogram()
+        self.metrics = None
+        self._conn = connection
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def depth(self):
+        ''' Number of queued requests. '''
+        return len(self._queue)
+
+    def _put(self, request):
+        ''' Queue a request, return its future. '''
+        with self._cond:
+            if self._closed:
+                raise ValueError("Scheduler is closed.")
+            self._queue.append(request)
+            depth = len(self._queue)
+            self.high_water = max(self.high_water, depth)
+            self._cond.notify()
+        if self.metrics:
+            self.metrics.gauge("send_queue_depth", depth)
+        return request.future
+
+    def send_once(self, remote, keys):
+        ''' Queue a SEND_ONCE for a list of keys, return a Future. '''
+        if not keys:
+            raise ValueError("No keys given")
+        return self._put(_Request(None, remote, list(keys)))
+
+    def start_repeat(self, remote, key):
+        ''' Queue a SEND_START, return a Future. '''
+        return self._put(_Request("SEND_START %s %s\n" % (remote, key)))
+
+    def stop_repeat(self, remote, key):
+        ''' Queue a SEND_STOP, return a Future. '''
+        return self._put(_Request("SEND_STOP %s %s\n" % (remote, key)))
+
+    def submit(self, command):
+        '''
+        Queue any lirc.client.Command or command string, e.g. a
+        SetTransmittersCommand, return a Future.
+        '''
+        if isinstance(command, lirc.client.Command):
+            command = command.cmd_string
+        return self._put(_Request(command))
+
+    def _next_batch(self):
+        '''
+        Remove and return next non-empty list of requests to run as one
+        command. Caller holds the lock.
+        '''
+        batch = [self._queue.popleft()]
+        if batch[0].command is not None:
+            return batch
+        nkeys = len(batch[0].keys)
+        while self._queue:
+            request = self._queue[0]
+            if request.command is not None \
+                    or request.remote != batch[0].remote \
+                    or nkeys + len(request.keys) > self.max_keys:
+                break
+            batch.append(self._queue.popleft())
+            nkeys += len(request.keys)
+        return batch
+
+    def _execute(self, batch):
+        ''' Run command for a batch of requests, resolve their futures. '''
+        now = time.monotonic()
+        for request in batch:
+            self.waits.observe(now - request.queued)
+            if self.metrics:
+                self.metrics.observe("send_wait", now - request.queued)
+        self.coalesced += len(batch) - 1
+        command = batch[0].command
+        if command is None:
+            keys = [k for r in batch for k in r.keys]
+            command = "SEND_ONCE %s %s\n" % (batch[0].remote, " ".join(keys))
+        try:
+            reply = lirc.client.Command(command, self._conn).run(self.timeout)
+        except (OSError, lirc.client.TimeoutException,
+                lirc.client.BadPacketException) as ex:
+            for request in batch:
+                request.future.set_exception(ex)
+        else:
+            for request in batch:
+                request.future.set_result(reply)
+        self.commands += 1
+
+    def _run(self):
+        ''' Thread body: run queued requests until closed. '''
+        next_time = 0
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._queue or self._closed)
+                if not self._queue:
+                    return
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            with self._cond:
+                batch = self._next_batch()
+            batch = [r for r in batch
+                     if r.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                self._execute(batch)
+            except Exception as ex:         # pylint: disable=broad-except
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(ex)
+            next_time = time.monotonic() + self.gap
+
+    def close(self):
+        ''' Run the queued requests, stop the thread, close connection. '''
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        self._conn.close()
+
+## @}
+#  python_bindings
@@ -0,0 +1,319 @@
+''' Cross-process keypress fan-out using shared memory. '''
+##
+#   @file shm.py
+#   @brief Publish keypresses to other processes through a mmap'ed ring.
+#   @ingroup  python_bindings
+
+##  @addtogroup python_bindings
+#   @{
+
+##
+#
+#   The ShmPublisher reads lircd once and writes parsed keypresses into a
+#   ring buffer in a memory mapped file, typically in /dev/shm. Any number
+#   of processes can read the ring using ShmConnection, which has the same
+#   readline()/readlines()/fileno()/has_data() interface as RawConnection,
+#   so it can also be used with e.g. lirc.async_client.AsyncConnection or
+#   lirc.reactor.Reactor. The API is unstable.
+#
+#   Publisher:
+#
+#          conn = lirc.client.RawConnection(socket_path, native=False)
+#          publisher = lirc.shm.ShmPublisher("/dev/shm/lirc-keys", conn)
+#          publisher.run()
+#
+#   Consumers, in any process:
+#
+#          conn = lirc.shm.ShmConnection("/dev/shm/lirc-keys")
+#          while True:
+#              keypress = conn.readline()
+#              ... do something with keypress
+#
+#   Consumers read the keypresses directly from the shared memory. The
+#   only socket involved is a wakeup socket at path + ".wake": the
+#   publisher sends one byte to each consumer per published batch, not
+#   per keypress. A consumer which has data available never touches it.
+#
+#   The ring has a fixed number of slots. A consumer which falls more
+#   than a full ring behind loses the oldest keypresses; these are
+#   counted in its lost attribute.
+#
+#   Ring layout: A 32 byte header (magic, slot count, slot size, write
+#   sequence number) followed by the slots. Each slot holds the sequence
+#   number + 1 (0 while being written), code, repeat count, key and remote
+#   name lengths and the names.
+
+import mmap
+import os
+import selectors
+import socket
+import struct
+import sys
+import time
+
+import lirc.client
+
+_MAGIC = b"LIRCSHM1"
+_HEADER = struct.Struct("<8sIIQQ")
+_WRITE_SEQ_OFFSET = 16
+_SEQ = struct.Struct("<Q")
+_SLOT_HEADER = struct.Struct("<QQIBB")
+
+
+class ShmPublisher(object):
+    '''
+    Reads keypresses from a RawConnection and writes them to a shared
+    memory ring. Parameters:
+      - path: Path to the ring file, created or truncated.
+      - connection: lirc.client.RawConnection to read from.
+      - slots: Number of keypresses in the ring.
+      - slot_size: Bytes per keypress, longer names are truncated.
+    '''
+
+    def __init__(self, path, connection, slots=1024, slot_size=128):
+        self.path = path
+        self._conn = connection
+        self._slots = slots
+        self._slot_size = slot_size
+        self._seq = 0
+        size = _HEADER.size + slots * slot_size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            self._mmap = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        _HEADER.pack_into(self._mmap, 0, _MAGIC, slots, slot_size, 0, 0)
+        if os.path.exists(path + ".wake"):
+            os.unlink(path + ".wake")
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listener.bind(path + ".wake")
+        self._listener.listen(64)
+        self._listener.setblocking(False)
+        self._consumers = []
+
+    def _accept(self):
+        ''' Accept pending consumer wakeup connections. '''
+        while True:
+            try:
+                sock, _ = self._listener.accept()
+            except BlockingIOError:
+                return
+            sock.setblocking(False)
+            self._consumers.append(sock)
+
+    def _wakeup(self):
+        ''' Send a wakeup byte to each consumer, drop closed ones. '''
+        for sock in list(self._consumers):
+            try:
+                sock.send(b"\0")
+            except BlockingIOError:
+                pass
+            except OSError:
+                self._consumers.remove(sock)
+                sock.close()
+
+    def publish(self, keypresses):
+        ''' Write a list of lirc.client.Keypress to the ring. '''
+        if not keypresses:
+            return
+        buf = self._mmap
+        room = self._slot_size - _SLOT_HEADER.size
+        for keypress in keypresses:
+            key = keypress.key.encode("ascii", "ignore")[:room // 2]
+            remote = keypress.remote.encode("ascii", "ignore")
+            remote = remote[:room - len(key)]
+            offset = _HEADER.size + (self._seq % self._slots) \
+                * self._slot_size
+            _SLOT_HEADER.pack_into(buf, offset, 0, keypress.code,
+                                   keypress.repeat, len(key), len(remote))
+            start = offset + _SLOT_HEADER.size
+            buf[start:start + len(key) + len(remote)] = key + remote
+            _SEQ.pack_into(buf, offset, self._seq + 1)
+            self._seq += 1
+        _SEQ.pack_into(buf, _WRITE_SEQ_OFFSET, self._seq)
+        self._wakeup()
+
+    def pump(self, timeout=0):
+        '''
+        Read all available keypresses from the connection and publish
+        them. timeout as for RawConnection.readline(). Returns number of
+        published keypresses.
+        '''
+        self._accept()
+        keypresses = []
+        for line in self._conn.readlines(timeout=timeout):
+            try:
+                keypresses.append(lirc.client.parse_keypress(line))
+            except lirc.client.BadPacketException:
+                pass
+        self.publish(keypresses)
+        return len(keypresses)
+
+    def run(self):
+        ''' Accept consumers and publish keypresses until an error. '''
+        select = selectors.DefaultSelector()
+        select.register(self._listener, selectors.EVENT_READ)
+        select.register(self._conn.fileno(), selectors.EVENT_READ)
+        try:
+            while True:
+                select.select()
+                self.pump(0)
+        finally:
+            select.close()
+
+    def close(self):
+        ''' Close consumer sockets, the ring and the connection. '''
+        for sock in self._consumers:
+            sock.close()
+        self._listener.close()
+        os.unlink(self.path + ".wake")
+        self._mmap.close()
+        self._conn.close()
+
+
+class ShmConnection(object):
+    '''
+    Reads keypresses published by a ShmPublisher. Parameters:
+      - path: Path to the ring file.
+
+    Only keypresses published after the connection is created are read.
+    The attribute lost counts keypresses overwritten before being read.
+    '''
+
+    def __init__(self, path):
+        self.lost = 0
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._slots, self._slot_size, seq, _ = \
+            _HEADER.unpack_from(self._mmap, 0)
+        if magic != _MAGIC:
+            raise lirc.client.BadPacketException("Bad ring file: " + path)
+        self._seq = seq
+        self._cache = {}
+        self._wake = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._wake.connect(path + ".wake")
+        self._wake.setblocking(False)
+        self._select = selectors.DefaultSelector()
+        self._select.register(self._wake, selectors.EVENT_READ)
+
+    def _write_seq(self):
+        ''' Return the publisher's current sequence number. '''
+        return _SEQ.unpack_from(self._mmap, _WRITE_SEQ_OFFSET)[0]
+
+    def has_data(self):
+        ''' Check if at least one keypress is available. '''
+        return self._write_seq() > self._seq
+
+    def fileno(self):
+        ''' Return the file nr used for IO, suitable for select() etc. '''
+        return self._wake.fileno()
+
+    def _wait(self, timeout):
+        ''' Wait for data, return False on timeout. '''
+        if timeout:
+            start = time.monotonic()
+        while not self.has_data():
+            if timeout is not None and timeout > 0:
+                to = start + timeout - time.monotonic()
+            else:
+                to = timeout
+            if not self._select.select(to):
+                return False
+            try:
+                if not self._wake.recv(4096):
+                    raise ConnectionResetError("Publisher has closed.")
+            except BlockingIOError:
+                pass
+        return True
+
+    def _read_slot(self, seq):
+        ''' Return Keypress in slot for seq, or None if overwritten. '''
+        buf = self._mmap
+        offset = _HEADER.size + (seq % self._slots) * self._slot_size
+        slot = buf[offset:offset + self._slot_size]
+        if _SEQ.unpack_from(slot, 0)[0] != seq + 1:
+            return None
+        _, code, repeat, keylen, remotelen = \
+            _SLOT_HEADER.unpack_from(slot, 0)
+        start = _SLOT_HEADER.size
+        key = slot[_SEQ.size:start + keylen + remotelen]
+        keypress = self._cache.get(key)
+        if keypress is None:
+            names = slot[start:start + keylen + remotelen].decode("ascii")
+            keypress = lirc.client.Keypress(
+                code, repeat,
+                sys.intern(names[:keylen]), sys.intern(names[keylen:]))
+            if len(self._cache) > 4096:
+                self._cache.clear()
+            self._cache[key] = keypress
+        if _SEQ.unpack_from(buf, offset)[0] != seq + 1:
+            return None
+        return keypress
+
+    def _skip_lost(self):
+        ''' Skip keypresses overwritten by publisher, return end seq. '''
+        end = self._write_seq()
+        if end - self._seq > self._slots:
+            self.lost += end - self._seq - self._slots
+            self._seq = end - self._slots
+        return end
+
+    def read_keypresses(self, timeout=None, max_lines=None):
+        '''
+        Return list of all available lirc.client.Keypress, waiting as
+        for RawConnection.readline() if there are none. If max_lines is
+        given at most this many are returned, leaving the rest unread.
+        '''
+        if not self._wait(timeout):
+            return []
+        end = self._skip_lost()
+        if max_lines:
+            end = min(end, self._seq + max_lines)
+        keypresses = []
+        for seq in range(self._seq, end):
+            keypress = self._read_slot(seq)
+            if keypress is None:
+                self.lost += 1
+            else:
+                keypresses.append(keypress)
+        self._seq = end
+        return keypresses
+
+    def read_keypress(self, timeout=None):
+        ''' Return next lirc.client.Keypress, None on timeout. '''
+        while self._wait(timeout):
+            self._skip_lost()
+            keypress = self._read_slot(self._seq)
+            self._seq += 1
+            if keypress is not None:
+                return keypress
+            self.lost += 1
+        return None
+
+    def readline(self, timeout=None):
+        '''
+        Read a code string formatted as in lircd(8), None on timeout.
+        The timeout is as for RawConnection.readline().
+        '''
+        keypress = self.read_keypress(timeout)
+        if keypress is None:
+            return None
+        return "%016x %02x %s %s" % keypress
+
+    def readlines(self, max_lines=None, timeout=None):
+        '''
+        Return list of available code strings formatted as in lircd(8),
+        see RawConnection.readlines() and read_keypresses().
+        '''
+        return ["%016x %02x %s %s" % keypress
+                for keypress in self.read_keypresses(timeout, max_lines)]
+
+    def close(self):
+        ''' Close the wakeup socket and the ring. '''
+        self._select.close()
+        self._wake.close()
+        self._mmap.close()
+
+## @}
+#  python_bindings
@@ -0,0 +1,106 @@
+''' TCP transport for the lircd socket protocol. '''
+##
+#   @file tcp.py
+#   @brief Connect to lircd instances listening on TCP.
+#   @ingroup  python_bindings
+
+##  @addtogroup python_bindings
+#   @{
+
+##
+#
+#   lircd serves the same protocol on TCP when started with --listen,
+#   by default on port 8765. All connections accept a tcp:// address
+#   instead of a socket path, e.g.:
+#
+#          conn = lirc.client.CommandConnection("tcp://blaster:8765")
+#          pool = lirc.pool.CommandConnectionPool("tcp://blaster")
+#          async with lirc.async_client.AsyncCommandConnection(
+#                  "tcp://[fe80::1]:8765") as conn:
+#              ...
+#
+#   Also the LIRC_SOCKET_PATH environment variable can be a tcp://
+#   address. The native argument is ignored for TCP connections, since
+#   lirc_init() only handles unix sockets.
+#
+#   TCP sockets are set up with TCP_NODELAY, so each command is sent
+#   at once, and with keepalive probes which detect a dead peer after
+#   KEEPALIVE_IDLE + 3 * KEEPALIVE_INTERVAL seconds. Connecting times
+#   out after CONNECT_TIMEOUT seconds. Other values can be used by
+#   connecting using connect() and passing the socket instead of an
+#   address:
+#
+#          sock = lirc.tcp.connect("tcp://blaster", timeout=1.0)
+#          conn = lirc.client.CommandConnection(sock)
+#
+#   Connections are persistent: a CommandConnection can run any number
+#   of commands, each costing a single round trip. Use a
+#   lirc.pool.CommandConnectionPool to reuse them across threads.
+
+import socket
+
+DEFAULT_PORT = 8765
+CONNECT_TIMEOUT = 5.0
+KEEPALIVE_IDLE = 30
+KEEPALIVE_INTERVAL = 10
+_PREFIX = "tcp://"
+
+
+def is_tcp_address(address):
+    ''' Check if address is a tcp:// address string. '''
+    return isinstance(address, str) and address.startswith(_PREFIX)
+
+
+def parse_address(address):
+    '''
+    Return (host, port) for a "tcp://host[:port]" address. IPv6
+    addresses are written in brackets, e.g. tcp://[::1]:8765.
+    '''
+    if not is_tcp_address(address):
+        raise ValueError("Not a tcp:// address: " + str(address))
+    hostport = address[len(_PREFIX):].rstrip("/")
+    if hostport.startswith("["):
+        host, _, rest = hostport[1:].partition("]")
+        port = rest[1:] if rest.startswith(":") else ""
+    else:
+        host, _, port = hostport.partition(":")
+    if not host:
+        raise ValueError("No host in address: " + address)
+    try:
+        return host, int(port) if port else DEFAULT_PORT
+    except ValueError:
+        raise ValueError("Bad port in address: " + address)
+
+
+def configure(sock):
+    ''' Set TCP_NODELAY and keepalive options on a connected socket. '''
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    if hasattr(socket, "TCP_KEEPIDLE"):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE,
+                        KEEPALIVE_IDLE)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL,
+                        KEEPALIVE_INTERVAL)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
+
+
+def connect(address, timeout=None):
+    '''
+    Return a blocking socket connected to a tcp:// address, configured
+    using configure(). timeout: Connect timeout in seconds, default
+    CONNECT_TIMEOUT. Raises OSError (socket.timeout) on failure.
+    '''
+    host, port = parse_address(address)
+    if timeout is None:
+        timeout = CONNECT_TIMEOUT
+    sock = socket.create_connection((host, port), timeout)
+    try:
+        sock.settimeout(None)
+        configure(sock)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+## @}
+#  python_bindings